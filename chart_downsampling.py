@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+# Points of a chart above which traces are drawn with WebGL instead of SVG
+default_webgl_threshold = 5000
+
+# Points kept per series by the downsampling, 0 keeps every point
+default_max_points = 1000
+
+
+def lttb(x, y, threshold):
+    """
+    Pick the points of a series to keep with Largest-Triangle-Three-Buckets, which keeps peaks and
+    troughs of the line. The first and last point are always kept.
+    :param x: numeric x values in ascending order
+    :param y: y values
+    :param threshold: number of points to keep
+    :return indices: positions of the kept points
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    indices = np.zeros(threshold, dtype=int)
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # average point of the next bucket is the third corner of the triangles
+        next_start = int(np.floor((i + 1) * every)) + 1
+        next_end = min(int(np.floor((i + 2) * every)) + 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        start = int(np.floor(i * every)) + 1
+        end = int(np.floor((i + 1) * every)) + 1
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        indices[i + 1] = a
+    indices[-1] = n - 1
+    return indices
+
+
+def downsample(data, x, y, group, max_points=default_max_points):
+    """
+    Downsample every series of a long format dataframe with LTTB
+    :param x: column of the x axis
+    :param y: column of the y axis
+    :param group: column naming the series, e.g. state
+    :param max_points: points kept per series, 0 keeps every point
+    :return: downsampled dataframe and number of dropped points
+    """
+    if not max_points:
+        return data, 0
+    parts = []
+    for name, series in data.dropna(subset=[y]).sort_values(by=[group, x]).groupby(group, sort=False):
+        x_values = series[x]
+        if pd.api.types.is_datetime64_any_dtype(x_values):
+            x_values = x_values.astype('int64')
+        parts.append(series.iloc[lttb(x_values.to_numpy(), series[y].to_numpy(), max_points)])
+    sampled = pd.concat(parts) if parts else data.iloc[:0]
+    return sampled, len(data) - len(sampled)
+
+
+def render_mode(points, webgl_threshold=default_webgl_threshold):
+    """
+    Get plotly express render mode of a chart with the given number of points
+    """
+    return 'webgl' if points > webgl_threshold else 'svg'
@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+import json
+import time
+import os
+
+# Default path of the checkpoint database
+default_store_file = os.path.join(os.getcwd(), r'result\checkpoints.db')
+
+# Partitions of sources scraped once per year are stored with month 0
+whole_year = 0
+
+
+def open_store(path):
+    """
+    Open the checkpoint store, creating the partitions table if needed
+    :param path: sqlite database file path
+    :return store: dictionary with connection, a lock shared by scraper threads and save listeners
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("CREATE TABLE IF NOT EXISTS partitions(source TEXT NOT NULL, year INTEGER NOT NULL, "
+                 "month INTEGER NOT NULL, records TEXT NOT NULL, scraped_at REAL NOT NULL, "
+                 "PRIMARY KEY (source, year, month))")
+    conn.commit()
+    return {'conn': conn, 'lock': threading.Lock(), 'listeners': []}
+
+
+def add_listener(store, listener):
+    """
+    Register a function called as listener(source, year, month, records) after every saved partition
+    """
+    store['listeners'].append(listener)
+
+
+def close_store(store):
+    """
+    Close the checkpoint store connection
+    """
+    store['conn'].close()
+
+
+def completed_partitions(store, source):
+    """
+    Get the partitions of a source which are already scraped
+    :return: set of (year, month)
+    """
+    with store['lock']:
+        rows = store['conn'].execute("SELECT year, month FROM partitions WHERE source = ?", (source,)).fetchall()
+    return set(rows)
+
+
+def save_partition(store, source, year, month, records):
+    """
+    Persist records of a scraped partition, replacing an older copy
+    """
+    with store['lock']:
+        store['conn'].execute("INSERT OR REPLACE INTO partitions(source, year, month, records, scraped_at) "
+                              "VALUES (?, ?, ?, ?, ?)", (source, year, month, json.dumps(records), time.time()))
+        store['conn'].commit()
+    for listener in store['listeners']:
+        listener(source, year, month, records)
+
+
+def load_partition(store, source, year, month):
+    """
+    Get records of a stored partition
+    :return: list of records, None if the partition was not scraped
+    """
+    with store['lock']:
+        row = store['conn'].execute("SELECT records FROM partitions WHERE source = ? AND year = ? AND month = ?",
+                                    (source, year, month)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def invalidate(store, source, year=None, month=None):
+    """
+    Remove stored partitions so that they are scraped again
+    :param year: only remove partitions of this year, every year if None
+    :param month: only remove this month of the year, every month if None
+    :return: number of removed partitions
+    """
+    query = "DELETE FROM partitions WHERE source = ?"
+    params = [source]
+    if year is not None:
+        query += " AND year = ?"
+        params.append(year)
+    if month is not None:
+        query += " AND month = ?"
+        params.append(month)
+    with store['lock']:
+        removed = store['conn'].execute(query, params).rowcount
+        store['conn'].commit()
+    return removed
+
+
+def apply_invalidations(store, source, invalidations, month_number=None):
+    """
+    Remove partitions listed in the checkpoint section of input.yaml for the given source
+    :param invalidations: list of dictionaries with source and optional year and month
+    :param month_number: function converting configured month to its stored number
+    """
+    for entry in invalidations or []:
+        if entry.get('source') != source:
+            continue
+        month = entry.get('month')
+        if month is not None and month_number is not None:
+            month = month_number(month)
+        removed = invalidate(store, source, entry.get('year'), month)
+        print('Invalidated {} {} partitions of {}'.format(removed, source, entry))
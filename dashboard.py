@@ -0,0 +1,137 @@
+import functools
+import time
+import os
+import yaml
+import dash
+from dash.dependencies import Input, Output
+import visualize_data
+
+try:
+    from dash import dcc, html
+except ImportError:
+    import dash_core_components as dcc
+    import dash_html_components as html
+
+# Input.yaml file path
+input_file = os.path.join(os.getcwd(), r'input.yaml')
+
+# Fetch function of every dataset sliced by state
+slice_fetchers = {'unemployment': visualize_data.fetch_unemployment_data,
+                  'education': visualize_data.fetch_education_data,
+                  'crime': visualize_data.fetch_crime_data}
+
+
+def in_years(data, years):
+    """
+    Get rows of a dataframe in the selected [first, last] year range
+    """
+    return data[data['year'].between(years[0], years[1])]
+
+
+def create_app(postgresqlDB_details, settings=None, visualize_settings=None):
+    """
+    Create the dashboard. Callbacks fetch only the rows of the selected state through the pooled
+    connections. Slices and built figures are kept in LRU caches keyed by the data generation, so new
+    loads are picked up.
+    :param settings: dashboard section of input.yaml
+    :param visualize_settings: visualize_settings section of input.yaml, used by the chart builders
+    :return: dash app
+    """
+    settings = settings or {}
+
+    @functools.lru_cache(maxsize=settings.get('slice_cache_size', 128))
+    def load_slice(dataset, state, generation):
+        return slice_fetchers[dataset](postgresqlDB_details, state=state)
+
+    @functools.lru_cache(maxsize=settings.get('slice_cache_size', 128))
+    def build_chart(chart, state, metric, first_year, last_year, generation):
+        years = [first_year, last_year]
+        if chart == 'unemployment':
+            return visualize_data.visualize_unemployment_rate(
+                in_years(load_slice('unemployment', state, generation), years), visualize_settings)
+        if chart == 'education':
+            return visualize_data.visualize_education_data(
+                in_years(load_slice('education', state, generation), years))
+        if chart == 'crime':
+            return visualize_data.visualize_crime_data(in_years(load_slice('crime', state, generation), years),
+                                                       state, metric)
+        unemployment_data = load_slice('unemployment', None, generation)
+        edu_total_data, crime_total_data = visualize_data.fetch_national_totals(postgresqlDB_details)
+        return visualize_data.visualize_combined_result(unemployment_data, edu_total_data, crime_total_data)
+
+    def chart_figures(chart, state=None, metric=None, years=(None, None)):
+        start = time.time()
+        figures = build_chart(chart, state, metric, years[0], years[1],
+                              visualize_data.data_generation(postgresqlDB_details))
+        print('{} chart of {} in {:.0f} ms, slice cache {}'.format(chart, state, (time.time() - start) * 1000,
+                                                                   load_slice.cache_info()))
+        return figures
+
+    states = visualize_data.fetch_frame(postgresqlDB_details, "SELECT name FROM state ORDER BY name",
+                                        {'name': 'object'})['name'].tolist()
+    years = visualize_data.fetch_frame(postgresqlDB_details, "SELECT min(year), max(year) FROM state_year",
+                                       {'first': 'float64', 'last': 'float64'}).iloc[0]
+    first_year, last_year = (int(years['first']), int(years['last'])) if years.notna().all() else (0, 0)
+    default_state = (visualize_settings or {}).get('crime_state', 'Alabama')
+
+    def layout():
+        # evaluated on every page load, the national chart only depends on the loaded data
+        return html.Div([
+            html.Div([
+                dcc.Dropdown(id='state', options=[{'label': state, 'value': state} for state in states],
+                             value=default_state, clearable=False),
+                dcc.Dropdown(id='metric', options=[{'label': column.replace('_', ' '), 'value': column}
+                                                   for column in visualize_data.crime_metrics.values()],
+                             value='Robbery', clearable=False),
+                dcc.RangeSlider(id='years', min=first_year, max=last_year, step=1, value=[first_year, last_year],
+                                marks={year: str(year) for year in range(first_year, last_year + 1)})
+            ]),
+            dcc.Graph(id='unemployment-chart'),
+            dcc.Graph(id='revenue-chart'),
+            dcc.Graph(id='expenditure-chart'),
+            dcc.Graph(id='crime-chart'),
+            dcc.Graph(id='combined-chart', figure=chart_figures('combined')[0])
+        ])
+
+    app = dash.Dash(__name__)
+    app.title = 'USA unemployment, education and crime'
+    app.layout = layout
+
+    # one callback per chart, so that the browser requests them concurrently and a metric
+    # change only rebuilds the crime chart
+    @app.callback(Output('unemployment-chart', 'figure'), [Input('state', 'value'), Input('years', 'value')])
+    def update_unemployment_chart(state, selected_years):
+        return chart_figures('unemployment', state, years=tuple(selected_years))[0]
+
+    @app.callback([Output('revenue-chart', 'figure'), Output('expenditure-chart', 'figure')],
+                  [Input('state', 'value'), Input('years', 'value')])
+    def update_education_charts(state, selected_years):
+        return chart_figures('education', state, years=tuple(selected_years))
+
+    @app.callback(Output('crime-chart', 'figure'),
+                  [Input('state', 'value'), Input('metric', 'value'), Input('years', 'value')])
+    def update_crime_chart(state, metric, selected_years):
+        return chart_figures('crime', state, metric, tuple(selected_years))[0]
+
+    return app
+
+
+def main(cfg=None):
+    """
+    Serve the dashboard on the host and port of the dashboard section of input.yaml
+    :param cfg: parsed input.yaml, read from input_file if None
+    """
+    # fetch inputs from input.yaml file unless the runner passed them
+    if cfg is None:
+        with open(input_file, 'r') as ymlfile:
+            cfg = yaml.safe_load(ymlfile)
+
+    settings = cfg.get('dashboard') or {}
+    app = create_app(cfg['postgresqlDB_details'], settings, cfg.get('visualize_settings'))
+    # dash 1.x names the server entry point run_server
+    run = getattr(app, 'run', None) or app.run_server
+    run(host=settings.get('host', '127.0.0.1'), port=settings.get('port', 8050), debug=False)
+
+
+if __name__ == "__main__":
+    main()
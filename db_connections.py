@@ -0,0 +1,181 @@
+import pymongo
+from pymongo import monitoring
+from psycopg2 import pool as pg_pool
+from contextlib import contextmanager
+import threading
+import atexit
+import time
+
+# Shared clients and pools of the pipeline, created on first use and kept for the whole run
+mongo_clients = {}
+pg_pools = {}
+registry_lock = threading.Lock()
+
+
+class MongoPoolStats(monitoring.ConnectionPoolListener):
+    """
+    Collect checkout count, checkout wait time and open connections of a MongoClient pool
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stats = {'checkouts': 0, 'wait_time': 0.0, 'open_connections': 0, 'checked_out': 0}
+
+    def update(self, key, value):
+        with self.lock:
+            self.stats[key] += value
+
+    def connection_check_out_started(self, event):
+        self.local.started = time.time()
+
+    def connection_checked_out(self, event):
+        self.update('checkouts', 1)
+        self.update('checked_out', 1)
+        self.update('wait_time', time.time() - getattr(self.local, 'started', time.time()))
+
+    def connection_checked_in(self, event):
+        self.update('checked_out', -1)
+
+    def connection_created(self, event):
+        self.update('open_connections', 1)
+
+    def connection_closed(self, event):
+        self.update('open_connections', -1)
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+def mongo_client(mongoDB_details):
+    """
+    Get the long-lived MongoClient of a mongodb link, its pool size comes from mongoDB_details
+    """
+    link = mongoDB_details['link']
+    with registry_lock:
+        if link not in mongo_clients:
+            listener = MongoPoolStats()
+            client = pymongo.MongoClient(link, maxPoolSize=mongoDB_details.get('max_pool_size', 100),
+                                         event_listeners=[listener])
+            mongo_clients[link] = {'client': client, 'listener': listener}
+        return mongo_clients[link]['client']
+
+
+def mongo_database(mongoDB_details):
+    """
+    Get the database of mongoDB_details from the shared MongoClient
+    """
+    return mongo_client(mongoDB_details)[mongoDB_details['db_name']]
+
+
+def get_pg_pool(postgresqlDB_details):
+    """
+    Get the shared psycopg2 connection pool of a postgresql database, created on first use
+    """
+    key = (postgresqlDB_details['pg_host'], str(postgresqlDB_details['pg_port']), postgresqlDB_details['pg_db'],
+           postgresqlDB_details['username'])
+    with registry_lock:
+        if key not in pg_pools:
+            max_connections = postgresqlDB_details.get('max_connections', 10)
+            connections = pg_pool.ThreadedConnectionPool(postgresqlDB_details.get('min_connections', 1),
+                                                         max_connections,
+                                                         user=postgresqlDB_details['username'],
+                                                         password=postgresqlDB_details['password'],
+                                                         host=postgresqlDB_details['pg_host'],
+                                                         port=postgresqlDB_details['pg_port'],
+                                                         database=postgresqlDB_details['pg_db'])
+            pg_pools[key] = {'pool': connections,
+                             'slots': threading.BoundedSemaphore(max_connections),
+                             'lock': threading.Lock(),
+                             'connections': set(),
+                             'stats': {'checkouts': 0, 'wait_time': 0.0, 'checked_out': 0}}
+        return pg_pools[key]
+
+
+@contextmanager
+def pg_connection(postgresqlDB_details):
+    """
+    Check out a pooled postgresql connection, waiting for a free one when the pool is exhausted.
+    The connection is rolled back on errors and returned to the pool afterwards.
+    """
+    pool = get_pg_pool(postgresqlDB_details)
+    start = time.time()
+    pool['slots'].acquire()
+    try:
+        conn = pool['pool'].getconn()
+    except Exception:
+        pool['slots'].release()
+        raise
+    with pool['lock']:
+        pool['stats']['checkouts'] += 1
+        pool['stats']['checked_out'] += 1
+        pool['stats']['wait_time'] += time.time() - start
+        pool['connections'].add(id(conn))
+
+    broken = False
+    try:
+        yield conn
+    except Exception:
+        broken = bool(conn.closed)
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        with pool['lock']:
+            pool['stats']['checked_out'] -= 1
+            if broken:
+                pool['connections'].discard(id(conn))
+        pool['pool'].putconn(conn, close=broken)
+        pool['slots'].release()
+
+
+def pool_stats():
+    """
+    Get statistics of every shared pool
+    :return stats: dictionary of pool name to checkouts, wait time, checked out and open connections
+    """
+    stats = {}
+    with registry_lock:
+        for link, mongo in mongo_clients.items():
+            with mongo['listener'].lock:
+                stats['mongodb {}'.format(link)] = dict(mongo['listener'].stats)
+        for key, pool in pg_pools.items():
+            with pool['lock']:
+                stats['postgresql {}:{}/{}'.format(*key[:3])] = dict(pool['stats'],
+                                                                       open_connections=len(pool['connections']))
+    return stats
+
+
+def print_pool_stats():
+    """
+    Print statistics of every shared pool
+    """
+    for name, stats in pool_stats().items():
+        print('{}: {} checkouts, {:.3f}s waiting, {} checked out, {} open connections'.format(
+            name, stats['checkouts'], stats['wait_time'], stats['checked_out'], stats['open_connections']))
+
+
+@atexit.register
+def close_all():
+    """
+    Close the shared MongoClients and postgresql pools
+    """
+    with registry_lock:
+        for mongo in mongo_clients.values():
+            mongo['client'].close()
+        for pool in pg_pools.values():
+            pool['pool'].closeall()
+        mongo_clients.clear()
+        pg_pools.clear()
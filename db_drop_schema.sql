@@ -0,0 +1,10 @@
+DROP MATERIALIZED VIEW IF EXISTS crime_year_totals;
+DROP MATERIALIZED VIEW IF EXISTS crime_state_totals;
+DROP MATERIALIZED VIEW IF EXISTS education_year_totals;
+DROP MATERIALIZED VIEW IF EXISTS unemployment_state_year;
+DROP TABLE IF EXISTS unemployment_rate;
+DROP TABLE IF EXISTS crime_rate;
+DROP TABLE IF EXISTS education_expenditure;
+DROP TABLE IF EXISTS state_year;
+DROP TABLE IF EXISTS state;
+DROP TABLE IF EXISTS load_digest;
\ No newline at end of file
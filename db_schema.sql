@@ -1,38 +1,57 @@
-DROP TABLE IF EXISTS unemployment_rate;
-DROP TABLE IF EXISTS crime_rate;
-DROP TABLE IF EXISTS education_expenditure;
-DROP TABLE IF EXISTS state_year;
-CREATE TABLE state_year(state_year_id VARCHAR (50) PRIMARY KEY,
-                           year VARCHAR (50) NOT NULL,
-                           state VARCHAR (50) NOT NULL
-                           );
-CREATE TABLE unemployment_rate(state_year_id VARCHAR (50) NOT NULL REFERENCES state_year (state_year_id),
-                                   month VARCHAR (50) NOT NULL,
-                                   unemployment_rate FLOAT NOT NULL,
-                                   PRIMARY KEY (state_year_id, month)
-                                   );
-CREATE TABLE crime_rate(state_year_id VARCHAR (50) NOT NULL REFERENCES state_year (state_year_id),
-                           population_coverage FLOAT,
-                           violent_crime_total FLOAT,
-                           murder_and_nonnegligent_manslaughter FLOAT,
-                           legacy_rape1 FLOAT,
-                           robbery FLOAT,
-                           aggravated_assault FLOAT,
-                           property_crime_total FLOAT,
-                           burglary FLOAT,
-                           larceny_theft FLOAT,
-                           motor_vehicle_theft FLOAT,
-                           PRIMARY KEY (state_year_id)
-                           );
-CREATE TABLE education_expenditure(state_year_id VARCHAR (50) NOT NULL REFERENCES state_year (state_year_id),
-                                       total_revenue FLOAT,
-                                       federal_revenue FLOAT,
-                                       state_revenue FLOAT,
-                                       local_revenue FLOAT,
-                                       total_expenditure FLOAT,
-                                       instruction_expenditure FLOAT,
-                                       support_services_expenditure FLOAT,
-                                       other_expenditure FLOAT,
-                                       capital_outlay_expenditure FLOAT,
-                                       PRIMARY KEY (state_year_id)
-                                       );
\ No newline at end of file
+CREATE TABLE IF NOT EXISTS state(state_id SMALLINT PRIMARY KEY,
+                                    fips_code CHAR (2) NOT NULL UNIQUE,
+                                    name VARCHAR (50) NOT NULL UNIQUE
+                                    );
+CREATE TABLE IF NOT EXISTS state_year(state_id SMALLINT NOT NULL REFERENCES state (state_id),
+                                         year SMALLINT NOT NULL,
+                                         PRIMARY KEY (state_id, year)
+                                         );
+CREATE INDEX IF NOT EXISTS state_year_year_idx ON state_year (year);
+CREATE TABLE IF NOT EXISTS unemployment_rate(state_id SMALLINT NOT NULL,
+                                                 year SMALLINT NOT NULL,
+                                                 month SMALLINT NOT NULL CHECK (month BETWEEN 1 AND 12),
+                                                 unemployment_rate FLOAT NOT NULL,
+                                                 PRIMARY KEY (state_id, year, month),
+                                                 FOREIGN KEY (state_id, year) REFERENCES state_year (state_id, year)
+                                                 );
+CREATE INDEX IF NOT EXISTS unemployment_rate_year_idx ON unemployment_rate (year);
+CREATE TABLE IF NOT EXISTS crime_rate(state_id SMALLINT NOT NULL,
+                                         year SMALLINT NOT NULL,
+                                         population_coverage FLOAT,
+                                         violent_crime_total FLOAT,
+                                         murder_and_nonnegligent_manslaughter FLOAT,
+                                         legacy_rape1 FLOAT,
+                                         robbery FLOAT,
+                                         aggravated_assault FLOAT,
+                                         property_crime_total FLOAT,
+                                         burglary FLOAT,
+                                         larceny_theft FLOAT,
+                                         motor_vehicle_theft FLOAT,
+                                         PRIMARY KEY (state_id, year),
+                                         FOREIGN KEY (state_id, year) REFERENCES state_year (state_id, year)
+                                         );
+CREATE INDEX IF NOT EXISTS crime_rate_year_idx ON crime_rate (year);
+CREATE TABLE IF NOT EXISTS education_expenditure(state_id SMALLINT NOT NULL,
+                                                     year SMALLINT NOT NULL,
+                                                     total_revenue FLOAT,
+                                                     federal_revenue FLOAT,
+                                                     state_revenue FLOAT,
+                                                     local_revenue FLOAT,
+                                                     total_expenditure FLOAT,
+                                                     instruction_expenditure FLOAT,
+                                                     support_services_expenditure FLOAT,
+                                                     other_expenditure FLOAT,
+                                                     capital_outlay_expenditure FLOAT,
+                                                     PRIMARY KEY (state_id, year),
+                                                     FOREIGN KEY (state_id, year) REFERENCES state_year (state_id, year)
+                                                     );
+CREATE INDEX IF NOT EXISTS education_expenditure_year_idx ON education_expenditure (year);
+CREATE TABLE IF NOT EXISTS load_digest(table_name VARCHAR (63) NOT NULL,
+                                           year SMALLINT NOT NULL,
+                                           digest CHAR (64) NOT NULL,
+                                           PRIMARY KEY (table_name, year)
+                                           );
+CREATE TABLE IF NOT EXISTS data_generation(generation_id SMALLINT PRIMARY KEY CHECK (generation_id = 1),
+                                               generation BIGINT NOT NULL,
+                                               loaded_at TIMESTAMP NOT NULL
+                                               );
\ No newline at end of file
@@ -0,0 +1,28 @@
+CREATE MATERIALIZED VIEW IF NOT EXISTS unemployment_state_year AS
+    SELECT unemp_rate.state_id, state.name AS state, unemp_rate.year,
+           avg(unemp_rate.unemployment_rate) AS avg_unemployment_rate
+    FROM unemployment_rate AS unemp_rate
+    JOIN state ON unemp_rate.state_id = state.state_id
+    GROUP BY unemp_rate.state_id, state.name, unemp_rate.year;
+CREATE UNIQUE INDEX IF NOT EXISTS unemployment_state_year_key ON unemployment_state_year (state_id, year);
+CREATE MATERIALIZED VIEW IF NOT EXISTS crime_state_totals AS
+    SELECT crime_rate.state_id, state.name AS state, crime_rate.year, crime_rate.robbery,
+           crime_rate.violent_crime_total, crime_rate.property_crime_total,
+           crime_rate.motor_vehicle_theft + crime_rate.larceny_theft + crime_rate.burglary +
+           crime_rate.property_crime_total + crime_rate.aggravated_assault + crime_rate.robbery +
+           crime_rate.legacy_rape1 + crime_rate.murder_and_nonnegligent_manslaughter +
+           crime_rate.violent_crime_total AS total_crime
+    FROM crime_rate
+    JOIN state ON crime_rate.state_id = state.state_id;
+CREATE UNIQUE INDEX IF NOT EXISTS crime_state_totals_key ON crime_state_totals (state_id, year);
+CREATE INDEX IF NOT EXISTS crime_state_totals_state_idx ON crime_state_totals (state);
+CREATE MATERIALIZED VIEW IF NOT EXISTS crime_year_totals AS
+    SELECT year, sum(total_crime) AS total_crime
+    FROM crime_state_totals
+    GROUP BY year;
+CREATE UNIQUE INDEX IF NOT EXISTS crime_year_totals_key ON crime_year_totals (year);
+CREATE MATERIALIZED VIEW IF NOT EXISTS education_year_totals AS
+    SELECT year, sum(total_revenue) AS total_revenue, sum(total_expenditure) AS total_expenditure
+    FROM education_expenditure
+    GROUP BY year;
+CREATE UNIQUE INDEX IF NOT EXISTS education_year_totals_key ON education_year_totals (year);
\ No newline at end of file
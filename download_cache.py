@@ -0,0 +1,173 @@
+import urllib.request as req
+from urllib.error import HTTPError
+import hashlib
+import tempfile
+import threading
+import json
+import time
+import os
+
+# Default directory of the download cache
+default_cache_dir = os.path.join(os.getcwd(), r'download_cache')
+
+
+def open_cache(settings=None):
+    """
+    Open the on-disk download cache described by the download_cache section of input.yaml
+    :return cache: dictionary with cache settings, the url index and the files handed out until close_cache
+    """
+    settings = settings or {}
+    cache_dir = settings.get('path', default_cache_dir)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    cache = {'dir': cache_dir,
+             'index_file': os.path.join(cache_dir, 'index.json'),
+             'max_bytes': settings.get('max_size_mb', 500) * 1024 * 1024,
+             'max_age': settings.get('max_age_days', 30) * 24 * 3600,
+             'offline': settings.get('offline', False),
+             'index': {},
+             'pinned': set(),
+             'orphans': set(),
+             'lock': threading.Lock()}
+    if os.path.exists(cache['index_file']):
+        with open(cache['index_file'], 'r') as index_file:
+            cache['index'] = json.load(index_file)
+    return cache
+
+
+def save_index(cache):
+    """
+    Write the url index of the cache to disk
+    """
+    with open(cache['index_file'], 'w') as index_file:
+        json.dump(cache['index'], index_file, indent=4, sort_keys=True)
+
+
+def blob_path(cache, digest):
+    """
+    Get path of a cached file from its content hash
+    """
+    return os.path.join(cache['dir'], digest)
+
+
+def fetch(cache, url):
+    """
+    Get a local copy of url, downloading it only when it is missing or changed.
+    Fresh entries are served without network I/O, older ones are revalidated with
+    ETag / If-Modified-Since and in offline mode only cached files are served.
+    The returned file is not removed before close_cache, so it can be read by other threads and processes.
+    :return path: path of the cached file
+    """
+    with cache['lock']:
+        entry = cache['index'].get(url)
+        if entry and not os.path.exists(blob_path(cache, entry['sha256'])):
+            entry = None
+        entry = dict(entry) if entry else None
+
+    if cache['offline']:
+        if entry is None:
+            raise IOError('{} is not cached and download cache is offline'.format(url))
+    elif entry is None or time.time() - entry['validated_at'] > cache['max_age']:
+        # Network I/O happens outside the lock so that downloads run concurrently
+        entry = download(cache, url, entry)
+
+    with cache['lock']:
+        entry['last_access'] = time.time()
+        previous = cache['index'].get(url)
+        cache['index'][url] = entry
+        cache['pinned'].add(entry['sha256'])
+        # A changed file leaves its old copy behind, which evict no longer sees once it left the index.
+        # A copy already handed out is removed by close_cache
+        if previous and previous['sha256'] != entry['sha256'] and \
+                all(other['sha256'] != previous['sha256'] for other in cache['index'].values()):
+            if previous['sha256'] in cache['pinned']:
+                cache['orphans'].add(previous['sha256'])
+            else:
+                remove_blob(cache, previous['sha256'])
+        evict(cache)
+        save_index(cache)
+    return blob_path(cache, entry['sha256'])
+
+
+def download(cache, url, entry):
+    """
+    Download url into the cache, sending a conditional request if an older copy exists
+    :return entry: index entry of the cached file
+    """
+    request = req.Request(url)
+    if entry:
+        if entry.get('etag'):
+            request.add_header('If-None-Match', entry['etag'])
+        if entry.get('last_modified'):
+            request.add_header('If-Modified-Since', entry['last_modified'])
+    try:
+        response = req.urlopen(request)
+    except HTTPError as e:
+        if e.code == 304 and entry:
+            # Not modified, keep serving the cached copy
+            entry['validated_at'] = time.time()
+            return entry
+        raise
+
+    # Store content under its hash, identical files share one copy
+    digest = hashlib.sha256()
+    with response, tempfile.NamedTemporaryFile(dir=cache['dir'], suffix='.tmp', delete=False) as temp_file:
+        temp_path = temp_file.name
+        for chunk in iter(lambda: response.read(64 * 1024), b''):
+            digest.update(chunk)
+            temp_file.write(chunk)
+    sha256 = digest.hexdigest()
+    os.replace(temp_path, blob_path(cache, sha256))
+    print('Downloaded {}'.format(url))
+
+    return {'sha256': sha256,
+            'size': os.path.getsize(blob_path(cache, sha256)),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'validated_at': time.time(),
+            'last_access': time.time()}
+
+
+def remove_blob(cache, digest):
+    """
+    Delete a cached file if it exists
+    """
+    if os.path.exists(blob_path(cache, digest)):
+        os.unlink(blob_path(cache, digest))
+
+
+def evict(cache):
+    """
+    Remove least recently used files until the cache fits its size limit, called with the cache lock held.
+    Files handed out by fetch since the cache was opened are kept
+    """
+    blobs = {}
+    for url, entry in cache['index'].items():
+        blobs.setdefault(entry['sha256'], {'size': entry['size'], 'last_access': 0, 'urls': []})
+        blobs[entry['sha256']]['last_access'] = max(blobs[entry['sha256']]['last_access'], entry['last_access'])
+        blobs[entry['sha256']]['urls'].append(url)
+
+    total = sum(blob['size'] for blob in blobs.values())
+    for sha256, blob in sorted(blobs.items(), key=lambda item: item[1]['last_access']):
+        if total <= cache['max_bytes']:
+            break
+        if sha256 in cache['pinned']:
+            continue
+        remove_blob(cache, sha256)
+        for url in blob['urls']:
+            del cache['index'][url]
+        total -= blob['size']
+
+
+def close_cache(cache):
+    """
+    Release the files handed out by fetch, remove replaced copies and shrink the cache to its size limit
+    """
+    with cache['lock']:
+        cache['pinned'].clear()
+        referenced = set(entry['sha256'] for entry in cache['index'].values())
+        for digest in cache['orphans'] - referenced:
+            remove_blob(cache, digest)
+        cache['orphans'].clear()
+        evict(cache)
+        save_index(cache)
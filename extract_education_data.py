@@ -1,94 +1,105 @@
 import pandas as pd
-import csv
-import urllib.request as req
-import json
-import os, shutil
+import download_cache
+import result_store
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import os
 import yaml
 
 # Input.yaml file path
 input_file = os.path.join(os.getcwd(), r'input.yaml')
 
-# json result file path for education data
-jsonFilePath = os.path.join(os.getcwd(), r'result\Education.json')
+# Census sheet columns kept in the education data
+financial_columns = ['TOTALREV', 'TFEDREV', 'TSTREV', 'TLOCREV', 'TOTALEXP', 'TCURINST', 'TCURSSVC', 'TCUROTH',
+                     'TCAPOUT']
 
-# create directory for saving education data files
-edu_files_path = os.path.join(os.getcwd(), r'edu_files')
-if not os.path.exists(edu_files_path):
-    os.makedirs(edu_files_path)
+
+def edu_file_url(year):
+    """
+    Get download link of the Census school finance xls file of a year
+    """
+    return "https://www2.census.gov/programs-surveys/school-finances/tables/{}/secondary-education-finance/elsec{}.xls"\
+        .format(year, year[2:4])
 
 
-def extract_edu_data(start_year, end_year):
+def parse_edu_year(i, xls_path):
     """
-    Etract education dataand create JSON file
+    Read the needed columns of the xls file of a year and aggregate them per state, runs in a worker process
+    :param i: year as string
+    :return output: education dataframe of the year with STATE, YEAR and financial columns
     """
-    data = []
-    output = {}
-    # Download data files and convert into csv for encoding formatting
-    for i in range(start_year, end_year + 1):
-        i = str(i)
-        j = i[2:4]
-        list = []
-        dls = "https://www2.census.gov/programs-surveys/school-finances/tables/{}/secondary-education-finance/elsec{}.xls"\
-            .format(i, j)
-        resp = req.urlretrieve(dls, os.path.join(os.getcwd(), r'edu_files\test_{}.xls'.format(i)))
-        output_xls = pd.read_excel(os.path.join(os.getcwd(), r'edu_files\test_{}.xls'.format(i)))
-        output_xls = output_xls.groupby(['STATE']).sum()
-        output_csv = output_xls.to_csv(os.path.join(os.getcwd(), r'edu_files\test_{}.csv'.format(i)))
-        csvFilePath = os.path.join(os.getcwd(), r'edu_files\test_{}.csv'.format(i))
-
-        with open(csvFilePath) as csvFile:
-            csvReader = csv.DictReader(csvFile)
-            for Row in csvReader:
-                output["STATE"] = Row["STATE"]
-                output["YEAR"] = i
-                output["TOTALREV"] = Row["TOTALREV"]
-                output["TFEDREV"] = Row["TFEDREV"]
-                output["TSTREV"] = Row["TSTREV"]
-                output["TLOCREV"] = Row["TLOCREV"]
-                output["TOTALEXP"] = Row["TOTALEXP"]
-                output["TCURINST"] = Row["TCURINST"]
-                output["TCURSSVC"] = Row["TCURSSVC"]
-                output["TCUROTH"] = Row["TCUROTH"]
-                output["TCAPOUT"] = Row["TCAPOUT"]
-                list.append(output.copy())
-        data.extend(list)
-
-    # Create JSON file from extracted data
-    with open(jsonFilePath, "w") as jsonFile:
-        json.dump(data, jsonFile, indent=4, sort_keys=True)
-
-def delete_edu_files():
+    output_xls = pd.read_excel(xls_path, usecols=['STATE'] + financial_columns)
+    output = output_xls.groupby('STATE', as_index=False)[financial_columns].sum()
+
+    # State codes and year are kept as strings like in the scraped datasets
+    output['STATE'] = output['STATE'].astype(int).astype(str)
+    output.insert(1, 'YEAR', i)
+    return output
+
+
+def extract_edu_data(start_year, end_year, cache, settings, download_workers=4, parse_workers=None):
     """
-    Delete all the xls and csv files from the directory
+    Etract education dataand create result file
+    :param cache: download cache serving the Census xls files
+    :param settings: result file format and compression
+    :param download_workers: number of concurrent downloads
+    :param parse_workers: number of processes parsing xls files, one per core if None
     """
-    for filename in os.listdir(edu_files_path):
-        file_path = os.path.join(edu_files_path, filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            print('Failed to delete %s. Reason: %s' % (file_path, e))
-
-
-def main():
+    years = [str(i) for i in range(start_year, end_year + 1)]
+    year_futures = {}
+    with ThreadPoolExecutor(max_workers=download_workers) as downloader, \
+            ProcessPoolExecutor(max_workers=parse_workers) as parser:
+        # Download files concurrently and hand every file to the parser processes as soon as it arrives
+        download_futures = {downloader.submit(download_cache.fetch, cache, edu_file_url(i)): i for i in years}
+        for future in as_completed(download_futures):
+            i = download_futures[future]
+            year_futures[i] = parser.submit(parse_edu_year, i, future.result())
+
+        if settings['format'] == 'ndjson':
+            # Stream every parsed year into the result file in year order, without keeping merged data
+            sink = result_store.open_sink('education')
+            try:
+                for i in years:
+                    result_store.write_partition(sink, year_futures.pop(i).result())
+            finally:
+                result_store.close_sink(sink)
+            return
+
+        # Merge parsed years in year order
+        data = pd.concat([year_futures[i].result() for i in years], ignore_index=True)
+
+    # Create result file from extracted data
+    result_store.write_records('education', data, settings['format'], settings['compression'])
+
+
+def main(cfg=None):
     """
     Etract education data
+    :param cfg: parsed input.yaml, read from input_file if None
     """
-    # fetch inputs from input.yaml file
-    with open(input_file, 'r') as ymlfile:
-        cfg = yaml.safe_load(ymlfile)
+    # fetch inputs from input.yaml file unless the runner passed them
+    if cfg is None:
+        with open(input_file, 'r') as ymlfile:
+            cfg = yaml.safe_load(ymlfile)
 
     start_year = cfg['data_period']['start_year']
     end_year = cfg['data_period']['end_year']
     
-    # Extract education data by downloading files and consolidate data into single JSON
-    extract_edu_data(start_year, end_year)
-    
-    # Delete all education data files
-    delete_edu_files()
-    
-    
+    # Unchanged xls files are served from the download cache
+    cache = download_cache.open_cache(cfg.get('download_cache'))
+
+    # Concurrency limits of the download and parsing stages
+    education_settings = cfg.get('education_settings', {})
+    download_workers = education_settings.get('download_workers', 4)
+    parse_workers = education_settings.get('parse_workers') or None
+
+    # Extract education data by downloading files and consolidate data into single result file
+    try:
+        extract_edu_data(start_year, end_year, cache, result_store.result_settings(cfg), download_workers,
+                         parse_workers)
+    finally:
+        # Downloaded files are only evicted once no parser process reads them any more
+        download_cache.close_cache(cache)
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
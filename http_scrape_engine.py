@@ -0,0 +1,106 @@
+import requests
+from requests.adapters import HTTPAdapter
+from lxml import html
+from urllib.parse import urljoin
+import table_extraction
+
+
+def create_session(pool_size=10):
+    """
+    Create a keep-alive HTTP session backed by a connection pool
+    :param pool_size: number of connections kept open per host
+    :return session: requests session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def load_form(session, url, select_id):
+    """
+    Download a page and read the form containing the given drop down
+    :return form: dictionary with form action, method, hidden fields and drop down options
+    """
+    response = session.get(url)
+    response.raise_for_status()
+    page = html.fromstring(response.content)
+    element = page.xpath('//select[@id=$id]/ancestor::form[1]', id=select_id)[0]
+
+    form = {'action': urljoin(response.url, element.get('action') or response.url),
+            'method': (element.get('method') or 'get').lower(),
+            'fields': {},
+            'selects': {}}
+
+    # Hidden inputs are sent along with every submission
+    for field in element.xpath('.//input[@type="hidden"][@name]'):
+        form['fields'][field.get('name')] = field.get('value', '')
+
+    # Keep name and options of every drop down to mimic selenium Select
+    for select in element.xpath('.//select'):
+        key = select.get('id') or select.get('name')
+        options = [(option.text_content().strip(), option.get('value', option.text_content().strip()))
+                   for option in select.xpath('.//option')]
+        form['selects'][key] = {'name': select.get('name') or key, 'options': options}
+    return form
+
+
+def select_by_visible_text(form, select_id, text):
+    """
+    Get form parameter for the drop down option having given text
+    :return: (field name, option value)
+    """
+    select = form['selects'][select_id]
+    for option_text, option_value in select['options']:
+        if option_text == text:
+            return select['name'], option_value
+    raise ValueError('Option {} not found in drop down {}'.format(text, select_id))
+
+
+def select_by_index(form, select_id, indexes):
+    """
+    Get form parameter for the drop down options at given indexes
+    :return: (field name, list of option values)
+    """
+    select = form['selects'][select_id]
+    return select['name'], [select['options'][i][1] for i in indexes]
+
+
+def submit_form(session, form, params):
+    """
+    Submit form with selected drop down values and parse the resulting page
+    :param params: list of (field name, value) selections
+    :return page: parsed html page
+    """
+    data = list(form['fields'].items()) + params
+    if form['method'] == 'post':
+        response = session.post(form['action'], data=data)
+    else:
+        response = session.get(form['action'], params=data)
+    response.raise_for_status()
+    return html.fromstring(response.content)
+
+
+def fetch_unemployment_rows(session, form, year, month):
+    """
+    Post year and month to MapToolServlet and read the result table
+    :return: list of rows, each a list of cell texts
+    """
+    params = [select_by_visible_text(form, 'year', str(year)),
+              select_by_visible_text(form, 'period', month)]
+    page = submit_form(session, form, params)
+    return table_extraction.page_table_cells(page, table_extraction.unemployment_table_xpath)
+
+
+def fetch_crime_rows(session, form, year):
+    """
+    Post states, crime groups and year to the UCR form and read the result table
+    :return: list of rows, each a list of cell texts
+    """
+    states_name, states = select_by_index(form, 'states', range(1, 52))
+    groups_name, groups = select_by_index(form, 'groups', range(0, 4))
+    params = [(states_name, state) for state in states] + [(groups_name, group) for group in groups]
+    params.append(select_by_visible_text(form, 'year', str(year)))
+    page = submit_form(session, form, params)
+    return table_extraction.page_table_cells(page, table_extraction.crime_table_xpath)
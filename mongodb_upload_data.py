@@ -1,26 +1,124 @@
 import pymongo
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 import os
-import json
+import time
+import result_store
+import db_connections
 import yaml
 
 # Input.yaml file path
 input_file = os.path.join(os.getcwd(), r'input.yaml')
 
-# Result file path of USA unemployment dataset
-unemployment_result = os.path.join(os.getcwd(), r'result\unemployment-data.json')
+# Seconds between two progress reports of a bulk load
+progress_interval = 5
 
-# Result file path of USA education dataset
-education_result = os.path.join(os.getcwd(), r'result\Education.json')
+# Natural keys of the datasets, used by the upsert load mode
+natural_keys = {'unemployment': ['state', 'year', 'month'],
+                'education': ['STATE', 'YEAR'],
+                'crime': ['State', 'Year']}
 
-# Result file path of education dataset
-crime_result = os.path.join(os.getcwd(), r'result\CrimeDatabyState.json')
 
+def bulk_load(records, batch_size, label, write_batch):
+    """
+    Write records in batches and report progress, the records are consumed incrementally
+    :param records: iterable of documents
+    :param label: dataset name used in progress reports
+    :param write_batch: function writing a list of documents
+    :return rows: number of processed documents
+    """
+    start = last_report = time.time()
+    rows = 0
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            write_batch(batch)
+            rows += len(batch)
+            batch = []
+            if time.time() - last_report >= progress_interval:
+                last_report = time.time()
+                print('Loaded {} {} documents, {:.0f} rows/sec'.format(rows, label, rows / (last_report - start)))
+    if batch:
+        write_batch(batch)
+        rows += len(batch)
+
+    elapsed = max(time.time() - start, 1e-6)
+    print('Loaded {} {} documents in {:.1f}s, {:.0f} rows/sec'.format(rows, label, elapsed, rows / elapsed))
+    return rows
+
+
+def report_write_errors(e, label):
+    """
+    Print the failed documents and write concern errors of a bulk write
+    :param e: BulkWriteError of the bulk write
+    """
+    write_errors = e.details.get('writeErrors', [])
+    if write_errors:
+        print('{} documents of {} data failed: {}'.format(len(write_errors), label, write_errors[0]['errmsg']))
+    for error in e.details.get('writeConcernErrors', []):
+        print('Write concern error on {} data: {}'.format(label, error['errmsg']))
+
+
+def bulk_insert(collection, records, batch_size, label):
+    """
+    Insert records in unordered batches
+    :return stats: dictionary with number of inserted documents
+    """
+    stats = {'inserted': 0}
+
+    def write_batch(batch):
+        try:
+            stats['inserted'] += len(collection.insert_many(batch, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            # Unordered inserts keep going after failed documents
+            report_write_errors(e, label)
+            stats['inserted'] += e.details['nInserted']
 
-def insert_unemp_data(usadb, unemp_collection_name):
+    bulk_load(records, batch_size, label, write_batch)
+    return stats
+
+
+def bulk_upsert(collection, records, keys, batch_size, label):
+    """
+    Upsert records by their natural key in unordered batches. Documents whose values did not change
+    are matched but not modified, so re-running on unchanged data writes nothing.
+    :param keys: fields identifying a document
+    :return stats: dictionary with number of matched, modified and upserted documents
+    """
+    # Unique index on the natural key, kept across runs
+    collection.create_index([(key, pymongo.ASCENDING) for key in keys], unique=True)
+    stats = {'matched': 0, 'modified': 0, 'upserted': 0}
+
+    def write_batch(batch):
+        requests = [UpdateOne({key: record[key] for key in keys}, {'$set': record}, upsert=True)
+                    for record in batch]
+        try:
+            result = collection.bulk_write(requests, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            report_write_errors(e, label)
+            result = e.details
+        stats['matched'] += result['nMatched']
+        stats['modified'] += result['nModified']
+        stats['upserted'] += result['nUpserted']
+
+    bulk_load(records, batch_size, label, write_batch)
+    print('{} data: {} unchanged, {} updated, {} new documents'.format(
+        label, stats['matched'] - stats['modified'], stats['modified'], stats['upserted']))
+    return stats
+
+
+def insert_unemp_data(usadb, unemp_collection_name, result_format='json', batch_size=1000, load_mode='reload'):
     """
     Create collection for unemployment data and insert data
+    :param load_mode: 'reload' drops and inserts the collection, 'upsert' only writes new or changed documents
     """
     unempcol = usadb[unemp_collection_name]
+    data = result_store.iter_records('unemployment', result_format)
+
+    if load_mode == 'upsert':
+        bulk_upsert(unempcol, data, natural_keys['unemployment'], batch_size, 'USA unemployment')
+        return
 
     # Delete if collection has already data
     if unemp_collection_name in usadb.list_collection_names():
@@ -28,20 +126,20 @@ def insert_unemp_data(usadb, unemp_collection_name):
         print("Dropped collection {} from database".format(unemp_collection_name))
         unempcol = usadb[unemp_collection_name]
 
-    with open(unemployment_result, encoding='utf-8') as data_file:
-        data = json.loads(data_file.read())
-
-    for record in data:
-        result = unempcol.insert_one(record)
-        print('Inserted USA unemployment data...')
-        print('Inserted post id %s ' % result.inserted_id)
+    bulk_insert(unempcol, data, batch_size, 'USA unemployment')
 
 
-def insert_education_data(usadb, edu_collection_name):
+def insert_education_data(usadb, edu_collection_name, result_format='json', batch_size=1000, load_mode='reload'):
     """
     Create collection for education data and insert data
+    :param load_mode: 'reload' drops and inserts the collection, 'upsert' only writes new or changed documents
     """
     edu_coll = usadb[edu_collection_name]
+    data = result_store.iter_records('education', result_format)
+
+    if load_mode == 'upsert':
+        bulk_upsert(edu_coll, data, natural_keys['education'], batch_size, 'USA educational')
+        return
 
     # Delete if collection has already data
     if edu_collection_name in usadb.list_collection_names():
@@ -49,20 +147,20 @@ def insert_education_data(usadb, edu_collection_name):
         print("Dropped collection {} from database".format(edu_collection_name))
         educoll = usadb[edu_collection_name]
 
-    with open(education_result, 'r', encoding='utf-8') as data_file:
-        data = (json.loads(data_file.read()))
-
-    for record in data:
-        result = edu_coll.insert_one(record)
-        print('Inserted USA educational data...')
-        print('Inserted post id %s ' % result.inserted_id)
+    bulk_insert(edu_coll, data, batch_size, 'USA educational')
 
 
-def insert_crime_data(usadb, crime_collection_name):
+def insert_crime_data(usadb, crime_collection_name, result_format='json', batch_size=1000, load_mode='reload'):
     """
     Create database, collection for crime dataset and insert data
+    :param load_mode: 'reload' drops and inserts the collection, 'upsert' only writes new or changed documents
     """
     crimecol = usadb[crime_collection_name]
+    data = result_store.iter_records('crime', result_format)
+
+    if load_mode == 'upsert':
+        bulk_upsert(crimecol, data, natural_keys['crime'], batch_size, 'USA Crime')
+        return
 
     # Delete if collection has already data
     if crime_collection_name in usadb.list_collection_names():
@@ -70,50 +168,38 @@ def insert_crime_data(usadb, crime_collection_name):
         print("Dropped collection {} from database".format(crime_collection_name))
         crimecol = usadb[crime_collection_name]
 
-    with open(crime_result, encoding='utf-8') as data_file:
-        data = json.loads(data_file.read())
-
-    for record in data:
-        result = crimecol.insert_one(record)
-        print('Inserted USA Crime data...')
-        print('Inserted post id %s ' % result.inserted_id)
-
-
-def connect_create_db(mongo_link, db_name):
-    """
-    Create connection with the mongodb and create database, collection
-    """
-    myclient = pymongo.MongoClient(mongo_link)
-    usadb = myclient[db_name]
-    return usadb
+    bulk_insert(crimecol, data, batch_size, 'USA Crime')
 
 
-def main():
+def main(cfg=None):
     """
     Import json data into mongodb
+    :param cfg: parsed input.yaml, read from input_file if None
     """
-    # fetch inputs from input.yaml file
-    with open(input_file, 'r') as ymlfile:
-        cfg = yaml.safe_load(ymlfile)
+    # fetch inputs from input.yaml file unless the runner passed them
+    if cfg is None:
+        with open(input_file, 'r') as ymlfile:
+            cfg = yaml.safe_load(ymlfile)
 
     # db name and collection name for all datasets in mongoDB
-    db_name = cfg['mongoDB_details']['db_name']
     unemp_collection_name = cfg['mongoDB_details']['unemp_collection_name']
     edu_collection_name = cfg['mongoDB_details']['edu_collection_name']
     crime_collection_name = cfg['mongoDB_details']['crime_collection_name']
-    mongo_link = cfg['mongoDB_details']['link']
+    result_format = result_store.result_settings(cfg)['format']
+    batch_size = cfg['mongoDB_details'].get('batch_size', 1000)
+    load_mode = cfg['mongoDB_details'].get('load_mode', 'reload')
 
-    # Create connection with mongoDB
-    db = connect_create_db(mongo_link, db_name)
+    # Shared connection with mongoDB
+    db = db_connections.mongo_database(cfg['mongoDB_details'])
 
     # Insert unemployment data into the mongodb
-    insert_unemp_data(db, unemp_collection_name)
+    insert_unemp_data(db, unemp_collection_name, result_format, batch_size, load_mode)
 
     # Insert education data into the mongodb
-    insert_education_data(db, edu_collection_name)
+    insert_education_data(db, edu_collection_name, result_format, batch_size, load_mode)
 
     # Insert crime rate data into the mongodb
-    insert_crime_data(db, crime_collection_name)
+    insert_crime_data(db, crime_collection_name, result_format, batch_size, load_mode)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+import time
+
+# Count rows of a table and look for a text in the rendered page in a single round-trip
+page_state_script = """
+var table = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null)
+    .singleNodeValue;
+var body = table && table.tBodies.length ? table.tBodies[0] : table;
+return {rows: body ? body.rows.length : 0,
+        text_found: arguments[1] ? document.body.innerText.indexOf(arguments[1]) >= 0 : false};
+"""
+
+
+def create_tracker(settings=None):
+    """
+    Create readiness settings and wait timing store for a scraper run
+    :param settings: page_readiness section of input.yaml
+    :return tracker: dictionary with timeout, poll frequency and recorded timings
+    """
+    settings = settings or {}
+    return {'timeout': settings.get('timeout', 30),
+            'poll_frequency': settings.get('poll_frequency', 0.2),
+            'timings': []}
+
+
+def find_table(driver, table_xpath):
+    """
+    Get the table currently rendered in the page, if any
+    """
+    tables = driver.find_elements_by_xpath(table_xpath)
+    return tables[0] if tables else None
+
+
+def wait_for_table(driver, tracker, page, table_xpath, min_rows, previous=None, expected_text=None):
+    """
+    Wait until the result table is rendered instead of sleeping a fixed time.
+    The page is ready once the previous table or page went stale (or the expected text is shown)
+    and the table has at least min_rows rows.
+    :param page: label of the page recorded with the wait timing
+    :param previous: element of the page before the form was submitted
+    :param expected_text: text shown once the page renders the selected period, e.g. 'January 2014'
+    :return elapsed: seconds waited
+    """
+    def ready(driver):
+        state = driver.execute_script(page_state_script, table_xpath, expected_text)
+        if previous is not None and not state['text_found'] and not EC.staleness_of(previous)(driver):
+            return False
+        return state['rows'] >= min_rows
+
+    start = time.time()
+    timed_out = False
+    try:
+        WebDriverWait(driver, tracker['timeout'], tracker['poll_frequency']).until(ready)
+    except TimeoutException:
+        # Scrape whatever is rendered, the parser reports missing rows
+        timed_out = True
+        print('Page {} not ready after {} seconds'.format(page, tracker['timeout']))
+    elapsed = time.time() - start
+    tracker['timings'].append({'page': page, 'seconds': elapsed, 'timed_out': timed_out})
+    return elapsed
+
+
+def summarize_timings(tracker):
+    """
+    Summarize recorded wait timings
+    :return: printable summary of page waits
+    """
+    timings = tracker['timings']
+    if not timings:
+        return 'No page waits recorded'
+    seconds = [timing['seconds'] for timing in timings]
+    timed_out = sum(1 for timing in timings if timing['timed_out'])
+    return 'Waited for {} pages: total {:.1f}s, mean {:.2f}s, max {:.2f}s, {} timed out'.format(
+        len(seconds), sum(seconds), sum(seconds) / len(seconds), max(seconds), timed_out)
@@ -0,0 +1,29 @@
+import os
+
+# Result files of every dataset, the extension depends on the format
+result_files = {'unemployment': os.path.join(os.getcwd(), r'result\unemployment-data'),
+                'education': os.path.join(os.getcwd(), r'result\Education'),
+                'crime': os.path.join(os.getcwd(), r'result\CrimeDatabyState')}
+
+# File extension of every supported format
+extensions = {'json': '.json', 'ndjson': '.ndjson', 'parquet': '.parquet'}
+
+# Default path of the html report
+default_report_path = os.path.join(os.getcwd(), r'result\report.html')
+
+
+def result_settings(cfg):
+    """
+    Get result file settings from input.yaml, json files by default
+    :return settings: dictionary with format and compression
+    """
+    settings = cfg.get('result_files', {})
+    return {'format': settings.get('format', 'json'),
+            'compression': settings.get('compression', 'snappy')}
+
+
+def result_path(dataset, fmt='json'):
+    """
+    Get path of the result file of a dataset
+    """
+    return result_files[dataset] + extensions[fmt]
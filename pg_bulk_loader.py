@@ -0,0 +1,124 @@
+import psycopg2 as pg
+from psycopg2.extras import execute_values
+import itertools
+import csv
+import io
+
+
+def chunks(rows, chunk_size):
+    """
+    Split an iterable of rows into lists of at most chunk_size rows
+    """
+    rows = iter(rows)
+    chunk = list(itertools.islice(rows, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(rows, chunk_size))
+
+
+def csv_buffer(chunk):
+    """
+    Write rows into an in-memory csv buffer readable by COPY, None becomes NULL
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(chunk)
+    buffer.seek(0)
+    return buffer
+
+
+def load_rows(conn, table, columns, rows, chunk_size=50000, use_copy=True):
+    """
+    Stream rows into a table with COPY FROM STDIN, one chunk at a time to bound client memory.
+    Falls back to execute_values when the server or driver rejects COPY.
+    The caller commits the transaction.
+    :param rows: iterable of tuples ordered like columns
+    :return loaded: number of loaded rows
+    """
+    cursor = conn.cursor()
+    copy_sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(table, ', '.join(columns))
+    insert_sql = "INSERT INTO {} ({}) VALUES %s".format(table, ', '.join(columns))
+    loaded = 0
+    for chunk in chunks(rows, chunk_size):
+        if use_copy:
+            cursor.execute("SAVEPOINT copy_chunk")
+            try:
+                cursor.copy_expert(copy_sql, csv_buffer(chunk))
+                cursor.execute("RELEASE SAVEPOINT copy_chunk")
+            except (pg.NotSupportedError, pg.ProgrammingError, pg.InternalError) as e:
+                # COPY not available, continue with multi-row inserts
+                cursor.execute("ROLLBACK TO SAVEPOINT copy_chunk")
+                print('COPY into {} failed, falling back to execute_values: {}'.format(table, e))
+                use_copy = False
+        if not use_copy:
+            execute_values(cursor, insert_sql, chunk, page_size=1000)
+        loaded += len(chunk)
+    cursor.close()
+    print('Loaded {} rows into {}'.format(loaded, table))
+    return loaded
+
+
+def upsert_rows(conn, table, columns, key_columns, rows, chunk_size=50000, use_copy=True):
+    """
+    Load rows into a temporary table and merge them into table with INSERT ... ON CONFLICT.
+    Existing rows are only updated when one of their values differs, so unchanged rows are not rewritten.
+    The caller commits the transaction.
+    :param key_columns: primary key columns of table
+    :return written: number of inserted or updated rows
+    """
+    incoming = '{}_incoming'.format(table)
+    cursor = conn.cursor()
+    cursor.execute("CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP".format(incoming, table))
+    load_rows(conn, incoming, columns, rows, chunk_size, use_copy)
+
+    value_columns = [column for column in columns if column not in key_columns]
+    column_list = ', '.join(columns)
+    key_list = ', '.join(key_columns)
+    if value_columns:
+        conflict_action = "DO UPDATE SET {} WHERE ({}) IS DISTINCT FROM ({})".format(
+            ', '.join('{0} = EXCLUDED.{0}'.format(column) for column in value_columns),
+            ', '.join('{}.{}'.format(table, column) for column in value_columns),
+            ', '.join('EXCLUDED.{}'.format(column) for column in value_columns))
+    else:
+        conflict_action = "DO NOTHING"
+
+    # DISTINCT ON keeps one row per key, ON CONFLICT cannot touch a row twice
+    cursor.execute("INSERT INTO {0} ({1}) SELECT DISTINCT ON ({2}) {1} FROM {3} ON CONFLICT ({2}) {4}".format(
+        table, column_list, key_list, incoming, conflict_action))
+    written = cursor.rowcount
+    cursor.close()
+    print('Inserted or updated {} rows of {}'.format(written, table))
+    return written
+
+
+def staging_table(table):
+    """
+    Get name of the staging copy of a table
+    """
+    return '{}_staging'.format(table)
+
+
+def create_staging_table(conn, table):
+    """
+    Create an empty staging copy of a table with its primary key, indexes and defaults
+    """
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS {}".format(staging_table(table)))
+    cursor.execute("CREATE TABLE {} (LIKE {} INCLUDING ALL)".format(staging_table(table), table))
+    cursor.close()
+
+
+def swap_staging_table(conn, table):
+    """
+    Replace a table by its loaded staging copy. Run every swap of a load in one transaction
+    so that readers switch from the old to the new tables at commit.
+    """
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE {} CASCADE".format(table))
+    cursor.execute("ALTER TABLE {} RENAME TO {}".format(staging_table(table), table))
+    # indexes copied by LIKE are named after the staging table, give them the names of the dropped ones
+    cursor.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+                   (table,))
+    for (index,) in cursor.fetchall():
+        if index.startswith(staging_table(table)):
+            cursor.execute("ALTER INDEX {} RENAME TO {}".format(index, table + index[len(staging_table(table)):]))
+    cursor.close()
@@ -1,8 +1,12 @@
-import pymongo
 import os
+import hashlib
 import pandas as pd
 from tabulate import tabulate
 import psycopg2 as pg
+from psycopg2.extras import execute_values
+import db_connections
+import pg_bulk_loader
+import result_store
 import yaml
 
 # Input.yaml file path
@@ -11,20 +15,93 @@ input_file = os.path.join(os.getcwd(), r'input.yaml')
 # schema creation sql file path
 create_schema_file = os.path.join(os.getcwd(), r'db_schema.sql')
 
+# sql file dropping the schema before a reload
+drop_schema_file = os.path.join(os.getcwd(), r'db_drop_schema.sql')
+
+# sql file creating the materialized views read by visualize_data
+create_views_file = os.path.join(os.getcwd(), r'db_views.sql')
+
+# Materialized views in refresh order, crime_year_totals is aggregated from crime_state_totals
+materialized_views = ['unemployment_state_year', 'crime_state_totals', 'crime_year_totals', 'education_year_totals']
+
+# Primary key columns of every table, used by incremental loads
+table_keys = {'state': ['state_id'],
+              'state_year': ['state_id', 'year'],
+              'unemployment_rate': ['state_id', 'year', 'month'],
+              'crime_rate': ['state_id', 'year'],
+              'education_expenditure': ['state_id', 'year']}
+
+# Foreign keys of the tables and the table they reference, restored after staging tables are swapped in
+foreign_keys = {'state_year': (['state_id'], 'state'),
+                'unemployment_rate': (['state_id', 'year'], 'state_year'),
+                'crime_rate': (['state_id', 'year'], 'state_year'),
+                'education_expenditure': (['state_id', 'year'], 'state_year')}
+
+# State dimension (state_id, FIPS code, name). state_id follows the state codes of the education dataset
+states = [(1, '01', 'Alabama'), (2, '02', 'Alaska'), (3, '04', 'Arizona'), (4, '05', 'Arkansas'),
+          (5, '06', 'California'), (6, '08', 'Colorado'), (7, '09', 'Connecticut'), (8, '10', 'Delaware'),
+          (9, '11', 'District of Columbia'), (10, '12', 'Florida'), (11, '13', 'Georgia'), (12, '15', 'Hawaii'),
+          (13, '16', 'Idaho'), (14, '17', 'Illinois'), (15, '18', 'Indiana'), (16, '19', 'Iowa'),
+          (17, '20', 'Kansas'), (18, '21', 'Kentucky'), (19, '22', 'Louisiana'), (20, '23', 'Maine'),
+          (21, '24', 'Maryland'), (22, '25', 'Massachusetts'), (23, '26', 'Michigan'), (24, '27', 'Minnesota'),
+          (25, '28', 'Mississippi'), (26, '29', 'Missouri'), (27, '30', 'Montana'), (28, '31', 'Nebraska'),
+          (29, '32', 'Nevada'), (30, '33', 'New Hampshire'), (31, '34', 'New Jersey'), (32, '35', 'New Mexico'),
+          (33, '36', 'New York'), (34, '37', 'North Carolina'), (35, '38', 'North Dakota'), (36, '39', 'Ohio'),
+          (37, '40', 'Oklahoma'), (38, '41', 'Oregon'), (39, '42', 'Pennsylvania'), (40, '44', 'Rhode Island'),
+          (41, '45', 'South Carolina'), (42, '46', 'South Dakota'), (43, '47', 'Tennessee'), (44, '48', 'Texas'),
+          (45, '49', 'Utah'), (46, '50', 'Vermont'), (47, '51', 'Virginia'), (48, '53', 'Washington'),
+          (49, '54', 'West Virginia'), (50, '55', 'Wisconsin'), (51, '56', 'Wyoming')]
+
+# state_id of every state name
+state_ids = {name: state_id for state_id, fips_code, name in states}
+
+months = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+          'November', 'December']
+
+
+def load_dataset(dataset, columns, mongoDB_details, collection_name, result_format=None):
+    """
+    Load the needed columns of a dataset from mongodb or directly from its result file
+    :param result_format: format of the result file to read, mongodb is read if None
+    :return: dataframe with the given columns
+    """
+    if result_format:
+        return result_store.read_frame(dataset, result_format, columns)
+
+    # Shared connection with the mongodb
+    usadb = db_connections.mongo_database(mongoDB_details)
+    projection = dict.fromkeys(columns, 1)
+    projection['_id'] = 0
+    return pd.DataFrame(list(usadb[mongoDB_details[collection_name]].find({}, projection)), columns=columns)
 
-def fetch_unemployment_data(mongoDB_details):
+
+def add_state_keys(data, state_column, year_column):
+    """
+    Add the integer state_id and year key columns, rows of unknown states or years are dropped
+    :param state_column: column holding the state name
+    :param year_column: column holding the year
+    :return: dataframe with state_id and year columns
+    """
+    data['state_id'] = data[state_column].astype(str).str.strip().map(state_ids)
+    data['year'] = pd.to_numeric(data[year_column].astype(str).str.strip(), errors='coerce')
+    unknown = data['state_id'].isna() | data['year'].isna()
+    if unknown.any():
+        print('Skipped {} rows of unknown states: {}'.format(
+            unknown.sum(), ', '.join(sorted(data.loc[unknown, state_column].astype(str).unique()))))
+        data = data[~unknown].copy()
+    data['state_id'] = data['state_id'].astype(int)
+    data['year'] = data['year'].astype(int)
+    return data
+
+
+def fetch_unemployment_data(mongoDB_details, result_format=None):
     """
     Fetch unemployment data from mongodb Clean and process
+    :param result_format: read the result file of this format instead of mongodb
     :return data: unemployment rate dataframe after cleanning and processing
     """
-
-    # Create connection with the mongodb
-    myclient = pymongo.MongoClient(mongoDB_details['link'])
-    usadb = myclient[mongoDB_details['db_name']]
-    scores = []
-    for score in list(usadb[mongoDB_details['unemp_collection_name']].find({}, {"_id":0})):
-        scores.append(score)
-    data = pd.DataFrame(scores, index=None)
+    data = load_dataset('unemployment', ['state', 'rate', 'month', 'year'], mongoDB_details,
+                        'unemp_collection_name', result_format)
 
     # Type casting on states
     data['rate'] = data['rate'].apply(pd.to_numeric, errors='coerce')
@@ -32,74 +109,55 @@ def fetch_unemployment_data(mongoDB_details):
     # Cleaning data (drop null value records)
     data.dropna()
 
-    # Merge year and state columns to get unique
-    data['state_year'] = data['state'] + data['year']
+    # Integer keys of the state, year and month
+    data = add_state_keys(data, 'state', 'year')
+    data['month'] = data['month'].map({name: number for number, name in enumerate(months, 1)})
+    data = data.dropna(subset=['month'])
+    data['month'] = data['month'].astype(int)
 
     return data
 
 
-def fetch_crime_data(mongoDB_details):
+def fetch_crime_data(mongoDB_details, result_format=None):
     """
     Fetch crime data from mongodb Clean and process
+    :param result_format: read the result file of this format instead of mongodb
     :return data: Crime rate dataframe after cleanning and processing
     """
-    # Create connection with the mongodb
-    myclient = pymongo.MongoClient(mongoDB_details['link'])
-    usaCrimeDb = myclient[mongoDB_details['db_name']]
-    crimes = []
-
     # keys
     keys = ['State', 'Year', 'Population_Coverage', 'Violent_crime_total', 'Murder_and_nonnegligent_manslaughter',
             'Legacy_rape1', 'Robbery', 'Aggravated_assault', 'Property_crime_total', 'Burglary', 'Larceny-theft',
             'Motor_vehicle_theft']
 
-    # Row wise data
-    for crime in list(usaCrimeDb[mongoDB_details['crime_collection_name']].find({}, {"_id":0})):
-        crimes.append(crime)
-    crime_data = pd.DataFrame(data=crimes, columns=keys)
+    crime_data = load_dataset('crime', keys, mongoDB_details, 'crime_collection_name', result_format)
 
     # Cleaning data (drop null value records)
     crime_data.dropna()
 
-    # Type casting string to float
+    # Type casting string to float, columnar result files already hold numbers
     for key in keys[2:12]:
-        crime_data[key] = crime_data[key].str.replace(',', '').astype(float)
+        crime_data[key] = crime_data[key].astype(str).str.replace(',', '').astype(float)
 
-    # Merge year and state columns to get unique
-    crime_data['state_year'] = crime_data['State'].str.strip() + crime_data['Year'].str.strip()
+    # Integer keys of the state and year
+    crime_data = add_state_keys(crime_data, 'State', 'Year')
 
     return crime_data
 
 
-def fetch_education_data(mongoDB_details):
+def fetch_education_data(mongoDB_details, result_format=None):
     """
     Fetch education data from mongodb Clean and process
+    :param result_format: read the result file of this format instead of mongodb
     :return edu_df: education rate dataframe after cleanning and processing
     """
-    fetch_list = []
     # Names of columns in the data
     financial_list = ['TOTALREV', 'TFEDREV', 'TSTREV', 'TLOCREV', 'TOTALEXP', 'TCURINST', 'TCURSSVC', 'TCUROTH',
                       'TCAPOUT']
 
-    # Create connection with the mongodb
-    myclient = pymongo.MongoClient(mongoDB_details['link'])
-    usadb = myclient[mongoDB_details['db_name']]
-
-    for item in (usadb[mongoDB_details['edu_collection_name']].find({}, {"_id": 0})):
-        fetch_list.append(item)
-
-    edu_df = pd.DataFrame(fetch_list, index=None)
-    edu_df['STATE'] = edu_df['STATE'].map(
-        {'1': 'Alabama', '2': 'Alaska', '3': 'Arizona', '4': 'Arkansas', '5': 'California', '6': 'Colorado',
-         '7': 'Connecticut', '8': 'Delaware', '9': 'District of Columbia', '10': 'Florida', '11': 'Georgia',
-         '12': 'Hawaii', '13': 'Idaho', '14': 'Illinois', '15': 'Indiana', '16': 'Iowa', '17': 'Kansas',
-         '18': 'Kentucky', '19': 'Louisiana', '20': 'Maine', '21': 'Maryland', '22': 'Massachusetts',
-         '23': 'Michigan', '24': 'Minnesota', '25': 'Mississippi', '26': 'Missouri', '27': 'Montana',
-         '28': 'Nebraska', '29': 'Nevada', '30': 'New Hampshire', '31': 'New Jersey', '32': 'New Mexico',
-         '33': 'New York', '34': 'North Carolina', '35': 'North Dakota', '36': 'Ohio', '37': 'Oklahoma',
-         '38': 'Oregon', '39': 'Pennsylvania', '40': 'Rhode Island', '41': 'South Carolina', '42': 'South Dakota',
-         '43': 'Tennessee', '44': 'Texas', '45': 'Utah', '46': 'Vermont', '47': 'Virginia',
-         '48': 'Washington', '49': 'West Virginia', '50': 'Wisconsin', '51': 'Wyoming'})
+    edu_df = load_dataset('education', ['STATE', 'YEAR'] + financial_list, mongoDB_details, 'edu_collection_name',
+                          result_format)
+    # education state codes are the state_id of the state
+    edu_df['STATE'] = edu_df['STATE'].astype(str).map({str(state_id): name for state_id, fips_code, name in states})
 
     # Type casting, convert string type into numeric
     for item in financial_list:
@@ -108,61 +166,124 @@ def fetch_education_data(mongoDB_details):
     # Cleaning data (drop null value records)
     edu_df.dropna()
 
-    # Merge year and state columns to get unique
-    edu_df['state_year'] = edu_df['STATE'] + edu_df['YEAR']
+    # Integer keys of the state and year
+    edu_df = add_state_keys(edu_df, 'STATE', 'YEAR')
 
     return edu_df
 
 
-def upload_state_year_data_postgres(data, postgresqlDB_details):
+def frame_rows(subset):
     """
-    Upload data into postgres
-    :param data: unemployment rate dataframe
+    Get rows of a dataframe as tuples, object dtype turns numpy scalars into python values for the
+    execute_values fallback
+    """
+    return subset.astype(object).itertuples(index=False, name=None)
+
+
+def year_digests(subset, table):
+    """
+    Get a content hash of the rows of every year, tables without a year column have none
+    :param subset: dataframe with columns in the order of the table columns
+    :return: dict of year to sha256 of its rows
+    """
+    if 'year' not in subset.columns:
+        return {}
+    subset = subset.sort_values(table_keys[table])
+    return {int(year): hashlib.sha256(rows.to_csv(index=False).encode('utf-8')).hexdigest()
+            for year, rows in subset.groupby('year')}
+
+
+def changed_years(conn, table, digests):
     """
-    subset = data[['state_year', 'state', 'year']]
-    subset.drop_duplicates(subset ="state_year", keep = 'last', inplace = True)
-    tuples = [tuple(x) for x in subset.to_numpy()]
+    Get the years whose rows differ from the ones of the last load
+    :param digests: dict of year to sha256 of its rows, from year_digests
+    :return: set of years
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT year, digest FROM load_digest WHERE table_name = %s", (table,))
+    loaded = dict(cursor.fetchall())
+    cursor.close()
+    return set(year for year, digest in digests.items() if loaded.get(year) != digest)
+
+
+def save_digests(conn, table, digests):
+    """
+    Record the content hashes of the loaded years of a table, the caller commits the transaction
+    """
+    if not digests:
+        return
+    cursor = conn.cursor()
+    execute_values(cursor, "INSERT INTO load_digest (table_name, year, digest) VALUES %s "
+                           "ON CONFLICT (table_name, year) DO UPDATE SET digest = EXCLUDED.digest",
+                   [(table, year, digest) for year, digest in digests.items()])
+    cursor.close()
+
+
+def copy_into_postgres(subset, table, columns, postgresqlDB_details):
+    """
+    Stream dataframe rows into a postgres table with COPY. Depending on load_mode the rows are copied
+    into the table ('reload'), upserted into it ('incremental') or copied into its staging table ('swap').
+    Incremental loads only stage the years whose rows changed since the last load.
+    :param subset: dataframe with columns in the order of the table columns
+    :return: True if the rows were loaded
+    """
+    load_mode = postgresqlDB_details.get('load_mode', 'reload')
+    chunk_size = postgresqlDB_details.get('copy_chunk_size', 50000)
+    use_copy = postgresqlDB_details.get('use_copy', True)
+    digests = year_digests(subset, table) if load_mode != 'swap' else {}
     try:
-        conn = pg.connect(user=postgresqlDB_details['username'],
-                          password=postgresqlDB_details['password'],
-                          host=postgresqlDB_details['pg_host'],
-                          port=postgresqlDB_details['pg_port'],
-                          database=postgresqlDB_details['pg_db'])
-        cursor = conn.cursor()
-        args_str = b",".join(cursor.mogrify("(%s,%s,%s)", x) for x in tuples)
-        cursor.execute("INSERT INTO state_year(state_year_id, state, year) VALUES " + args_str.decode("utf-8"))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with db_connections.pg_connection(postgresqlDB_details) as conn:
+            if load_mode == 'incremental':
+                if digests:
+                    years = changed_years(conn, table, digests)
+                    print('{} of {} years of {} changed'.format(len(years), len(digests), table))
+                    subset = subset[subset['year'].isin(years)]
+                    digests = {year: digests[year] for year in years}
+                pg_bulk_loader.upsert_rows(conn, table, columns, table_keys[table], frame_rows(subset),
+                                           chunk_size, use_copy)
+            elif load_mode == 'swap':
+                pg_bulk_loader.load_rows(conn, pg_bulk_loader.staging_table(table), columns, frame_rows(subset),
+                                         chunk_size, use_copy)
+            else:
+                pg_bulk_loader.load_rows(conn, table, columns, frame_rows(subset), chunk_size, use_copy)
+            save_digests(conn, table, digests)
+            conn.commit()
+        return True
     except (Exception, pg.Error) as e:
         print(e)
+        return False
+
+
+def upload_state_data_postgres(postgresqlDB_details):
+    """
+    Upload the state dimension into postgres
+    """
+    subset = pd.DataFrame(states, columns=['state_id', 'fips_code', 'name'])
+    return copy_into_postgres(subset, 'state', ['state_id', 'fips_code', 'name'], postgresqlDB_details)
+
+
+def upload_state_year_data_postgres(data, postgresqlDB_details):
+    """
+    Upload data into postgres
+    :param data: unemployment rate dataframe
+    """
+    subset = data[['state_id', 'year']]
+    subset = subset.drop_duplicates(keep='last')
+    return copy_into_postgres(subset, 'state_year', ['state_id', 'year'], postgresqlDB_details)
+
 
 def upload_crime_data_postgres(data, postgresqlDB_details):
     """
     Upload crime data into postgres
     :param data: crime rate dataframe
     """
-    subset = data[['state_year', 'Population_Coverage', 'Violent_crime_total', 'Murder_and_nonnegligent_manslaughter',
-            'Legacy_rape1', 'Robbery', 'Aggravated_assault', 'Property_crime_total', 'Burglary', 'Larceny-theft',
-            'Motor_vehicle_theft']]
-    tuples = [tuple(x) for x in subset.to_numpy()]
-    try:
-        conn = pg.connect(user=postgresqlDB_details['username'],
-                          password=postgresqlDB_details['password'],
-                          host=postgresqlDB_details['pg_host'],
-                          port=postgresqlDB_details['pg_port'],
-                          database=postgresqlDB_details['pg_db'])
-        cursor = conn.cursor()
-        args_str = b",".join(cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", x) for x in tuples)
-        cursor.execute("INSERT INTO crime_rate(state_year_id, population_coverage, violent_crime_total, "
-                       "murder_and_nonnegligent_manslaughter, legacy_rape1, robbery, aggravated_assault, "
-                       "property_crime_total, burglary, larceny_theft, motor_vehicle_theft) VALUES " +
-                       args_str.decode("utf-8"))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except (Exception, pg.Error) as e:
-        print(e)
+    subset = data[['state_id', 'year', 'Population_Coverage', 'Violent_crime_total',
+            'Murder_and_nonnegligent_manslaughter', 'Legacy_rape1', 'Robbery', 'Aggravated_assault',
+            'Property_crime_total', 'Burglary', 'Larceny-theft', 'Motor_vehicle_theft']]
+    return copy_into_postgres(subset, 'crime_rate', ['state_id', 'year', 'population_coverage', 'violent_crime_total',
+                                              'murder_and_nonnegligent_manslaughter', 'legacy_rape1', 'robbery',
+                                              'aggravated_assault', 'property_crime_total', 'burglary',
+                                              'larceny_theft', 'motor_vehicle_theft'], postgresqlDB_details)
 
 
 def upload_unemployment_data_postgres(data, postgresqlDB_details):
@@ -170,23 +291,9 @@ def upload_unemployment_data_postgres(data, postgresqlDB_details):
     Upload unemployment data into postgres
     :param data: unemployment rate dataframe
     """
-    subset = data[['state_year', 'month', 'rate']]
-    tuples = [tuple(x) for x in subset.to_numpy()]
-    try:
-        conn = pg.connect(user=postgresqlDB_details['username'],
-                          password=postgresqlDB_details['password'],
-                          host=postgresqlDB_details['pg_host'],
-                          port=postgresqlDB_details['pg_port'],
-                          database=postgresqlDB_details['pg_db'])
-        cursor = conn.cursor()
-        args_str = b",".join(cursor.mogrify("(%s,%s,%s)", x) for x in tuples)
-        cursor.execute("INSERT INTO unemployment_rate(state_year_id, month, unemployment_rate) VALUES " +
-                       args_str.decode("utf-8"))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except (Exception, pg.Error) as e:
-        print(e)
+    subset = data[['state_id', 'year', 'month', 'rate']]
+    return copy_into_postgres(subset, 'unemployment_rate', ['state_id', 'year', 'month', 'unemployment_rate'],
+                       postgresqlDB_details)
 
 
 def upload_education_data_postgres(data, postgresqlDB_details):
@@ -194,78 +301,213 @@ def upload_education_data_postgres(data, postgresqlDB_details):
     Upload education data into postgres
     :param data: education expenditure and revenue dataframe
     """
-    subset = data[['state_year', 'TOTALREV', 'TFEDREV', 'TSTREV', 'TLOCREV', 'TOTALEXP', 'TCURINST', 'TCURSSVC',
+    subset = data[['state_id', 'year', 'TOTALREV', 'TFEDREV', 'TSTREV', 'TLOCREV', 'TOTALEXP', 'TCURINST', 'TCURSSVC',
                    'TCUROTH', 'TCAPOUT']]
-    subset.drop_duplicates(subset="state_year", keep='last', inplace=True)
-    tuples = [tuple(x) for x in subset.to_numpy()]
+    subset = subset.drop_duplicates(subset=['state_id', 'year'], keep='last')
+    return copy_into_postgres(subset, 'education_expenditure', ['state_id', 'year', 'total_revenue', 'federal_revenue',
+                                                         'state_revenue', 'local_revenue', 'total_expenditure',
+                                                         'instruction_expenditure', 'support_services_expenditure',
+                                                         'other_expenditure', 'capital_outlay_expenditure'],
+                       postgresqlDB_details)
+
+
+def schema_is_current(postgresqlDB_details):
+    """
+    Check that existing tables have the key columns of db_schema.sql. Databases created with the
+    text keyed schema lack them and can only be reloaded
+    :return: True if every existing table is keyed like table_keys, None if the tables could not be read
+    """
+    try:
+        with db_connections.pg_connection(postgresqlDB_details) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT table_name, column_name FROM information_schema.columns "
+                           "WHERE table_schema = current_schema()")
+            columns = {}
+            for table, column in cursor.fetchall():
+                columns.setdefault(table, set()).add(column)
+            cursor.close()
+    except (Exception, pg.Error) as e:
+        print(e)
+        return None
+    return all(set(keys).issubset(columns[table]) for table, keys in table_keys.items() if table in columns)
+
+
+def create_schema(postgresqlDB_details, drop=False):
+    """
+    Create postgres schema, tables which already exist are kept
+    :param drop: drop the existing tables first
+    :return: True if the schema was created
+    """
+    try:
+        with db_connections.pg_connection(postgresqlDB_details) as conn:
+            cursor = conn.cursor()
+            if drop:
+                with open(drop_schema_file, 'r') as file:
+                    cursor.execute(" ".join(file.readlines()))
+            file = open(create_schema_file, 'r')
+            sql_file = s = " ".join(file.readlines())
+            cursor.execute(sql_file)
+            conn.commit()
+            cursor.close()
+        return True
+    except (Exception, pg.Error) as e:
+        print(e)
+        return False
+
+
+def create_staging_tables(postgresqlDB_details):
+    """
+    Create empty staging copies of all tables for a swap load
+    :return: True if the staging tables were created
+    """
+    try:
+        with db_connections.pg_connection(postgresqlDB_details) as conn:
+            for table in table_keys:
+                pg_bulk_loader.create_staging_table(conn, table)
+            conn.commit()
+        return True
+    except (Exception, pg.Error) as e:
+        print(e)
+        return False
+
+
+def refresh_views(postgresqlDB_details):
+    """
+    Create missing materialized views and refresh all of them concurrently, so charts can keep reading
+    the previous rollups while they are rebuilt
+    :return: True if the views were refreshed
+    """
+    try:
+        with db_connections.pg_connection(postgresqlDB_details) as conn:
+            cursor = conn.cursor()
+            with open(create_views_file, 'r') as file:
+                cursor.execute(" ".join(file.readlines()))
+            conn.commit()
+            for view in materialized_views:
+                cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY {}".format(view))
+                conn.commit()
+            cursor.close()
+        print('Refreshed materialized views')
+        return True
+    except (Exception, pg.Error) as e:
+        print(e)
+        return False
+
+
+def bump_generation(postgresqlDB_details):
+    """
+    Increment the data generation counter, which keys the query result cache of visualize_data
+    :return: True if the counter was incremented
+    """
     try:
-        conn = pg.connect(user=postgresqlDB_details['username'],
-                          password=postgresqlDB_details['password'],
-                          host=postgresqlDB_details['pg_host'],
-                          port=postgresqlDB_details['pg_port'],
-                          database=postgresqlDB_details['pg_db'])
-        cursor = conn.cursor()
-        args_str = b",".join(cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", x) for x in tuples)
-        cursor.execute(
-            "INSERT INTO education_expenditure(state_year_id, total_revenue, federal_revenue, state_revenue, "
-            "local_revenue, total_expenditure, instruction_expenditure, support_services_expenditure, "
-            "other_expenditure, capital_outlay_expenditure) VALUES " + args_str.decode("utf-8"))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with db_connections.pg_connection(postgresqlDB_details) as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO data_generation (generation_id, generation, loaded_at) VALUES (1, 1, now()) "
+                           "ON CONFLICT (generation_id) DO UPDATE "
+                           "SET generation = data_generation.generation + 1, loaded_at = now() "
+                           "RETURNING generation")
+            print('Data generation {}'.format(cursor.fetchone()[0]))
+            cursor.close()
+            conn.commit()
+        return True
     except (Exception, pg.Error) as e:
         print(e)
+        return False
 
 
-def create_schema(postgresqlDB_details):
+def swap_staging_tables(postgresqlDB_details):
     """
-    Create postgres schema
+    Replace all tables by their loaded staging copies and rebuild the materialized views in one transaction
+    :return: True if the tables were swapped
     """
     try:
-        conn = pg.connect(user=postgresqlDB_details['username'],
-                          password=postgresqlDB_details['password'],
-                          host=postgresqlDB_details['pg_host'],
-                          port=postgresqlDB_details['pg_port'],
-                          database=postgresqlDB_details['pg_db'])
-        cursor = conn.cursor()
-        file = open(create_schema_file, 'r')
-        sql_file = s = " ".join(file.readlines())
-        cursor.execute(sql_file)
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with db_connections.pg_connection(postgresqlDB_details) as conn:
+            for table in table_keys:
+                pg_bulk_loader.swap_staging_table(conn, table)
+            cursor = conn.cursor()
+            for table, (columns, referenced) in foreign_keys.items():
+                cursor.execute("ALTER TABLE {0} ADD FOREIGN KEY ({1}) REFERENCES {2} ({1})".format(
+                    table, ', '.join(columns), referenced))
+            # the year hashes describe the replaced tables, the next incremental load compares every year again
+            cursor.execute("DELETE FROM load_digest")
+            # dropping the old tables cascaded to the materialized views, rebuild them before readers see the swap
+            with open(create_views_file, 'r') as file:
+                cursor.execute(" ".join(file.readlines()))
+            cursor.close()
+            conn.commit()
+        print('Swapped in staging tables')
+        return True
     except (Exception, pg.Error) as e:
         print(e)
+        return False
 
 
 
-def main():
+def main(cfg=None):
     """
     Import data into postgresql db
+    :param cfg: parsed input.yaml, read from input_file if None
     """
-    # fetch inputs from input.yaml file
-    with open(input_file, 'r') as ymlfile:
-        cfg = yaml.safe_load(ymlfile)
+    # fetch inputs from input.yaml file unless the runner passed them
+    if cfg is None:
+        with open(input_file, 'r') as ymlfile:
+            cfg = yaml.safe_load(ymlfile)
 
     # db name and collection name for all datasets in mongoDB
     mongoDB_details = cfg['mongoDB_details']
     postgresqlDB_details = cfg['postgresqlDB_details']
 
-    # create postgresql database schema
-    create_schema(postgresqlDB_details)
+    # Datasets are read from mongodb unless postgres_source points to the result files
+    result_format = None
+    if cfg.get('result_files', {}).get('postgres_source', 'mongodb') == 'result_files':
+        result_format = result_store.result_settings(cfg)['format']
+
+    # create postgresql database schema, existing tables are only dropped for a full reload
+    load_mode = postgresqlDB_details.get('load_mode', 'reload')
+    if load_mode != 'reload' and schema_is_current(postgresqlDB_details) is False:
+        print('Tables do not match db_schema.sql, falling back to a full reload')
+        load_mode = 'reload'
+        postgresqlDB_details = dict(postgresqlDB_details, load_mode=load_mode)
+    if not create_schema(postgresqlDB_details, drop=load_mode == 'reload'):
+        raise RuntimeError('Could not create the postgres schema')
+    if load_mode == 'swap' and not create_staging_tables(postgresqlDB_details):
+        raise RuntimeError('Could not create the staging tables')
 
     # get unemployment data from mongo db and import into postgresql db
-    data = fetch_unemployment_data(mongoDB_details)
-    upload_state_year_data_postgres(data, postgresqlDB_details)
-    upload_unemployment_data_postgres(data, postgresqlDB_details)
+    data = fetch_unemployment_data(mongoDB_details, result_format)
+    loaded = [upload_state_data_postgres(postgresqlDB_details),
+              upload_state_year_data_postgres(data, postgresqlDB_details),
+              upload_unemployment_data_postgres(data, postgresqlDB_details)]
 
     # get education data from mongo db and import into postgresql db
-    edu_data = fetch_education_data(mongoDB_details)
-    upload_education_data_postgres(edu_data, postgresqlDB_details)
+    edu_data = fetch_education_data(mongoDB_details, result_format)
+    loaded.append(upload_education_data_postgres(edu_data, postgresqlDB_details))
 
     # get crime rate data from mongo db and import into postgresql db
-    crime_data = fetch_crime_data(mongoDB_details)
-    upload_crime_data_postgres(crime_data, postgresqlDB_details)
+    crime_data = fetch_crime_data(mongoDB_details, result_format)
+    loaded.append(upload_crime_data_postgres(crime_data, postgresqlDB_details))
+
+    # live tables keep serving the previous load until every staging table loaded
+    swapped = True
+    if load_mode == 'swap':
+        if all(loaded):
+            swapped = swap_staging_tables(postgresqlDB_details)
+        else:
+            print('Staging load failed, keeping the existing tables')
+
+    # rebuild the rollups read by the charts
+    refreshed = refresh_views(postgresqlDB_details)
+
+    # cached query results of older generations become stale, a failed swap left the data unchanged
+    bumped = False
+    if load_mode != 'swap' or (all(loaded) and swapped):
+        bumped = bump_generation(postgresqlDB_details)
+
+    # the runner only records the load as done when every step succeeded
+    if not all(loaded):
+        raise RuntimeError('{} of {} tables failed to load'.format(loaded.count(False), len(loaded)))
+    if not (swapped and refreshed and bumped):
+        raise RuntimeError('Postgres load did not finish, see the errors above')
 
 
 
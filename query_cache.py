@@ -0,0 +1,131 @@
+import hashlib
+import tempfile
+import threading
+import json
+import time
+import os
+
+# Default directory of the query result cache
+default_cache_dir = os.path.join(os.getcwd(), r'query_cache')
+
+
+def open_cache(settings=None, generation=None):
+    """
+    Open the on-disk query result cache described by the query_cache section of input.yaml
+    :param generation: data generation of the database, entries of older generations are stale
+    :return cache: dictionary with cache settings, the entry index and hit/miss stats
+    """
+    settings = settings or {}
+    cache_dir = settings.get('path', default_cache_dir)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    cache = {'dir': cache_dir,
+             'index_file': os.path.join(cache_dir, 'index.json'),
+             'max_bytes': settings.get('max_size_mb', 200) * 1024 * 1024,
+             'generation': generation,
+             'index': {},
+             'lock': threading.Lock(),
+             'stats': {'hits': 0, 'misses': 0, 'evictions': 0}}
+    if os.path.exists(cache['index_file']):
+        with open(cache['index_file'], 'r') as index_file:
+            cache['index'] = json.load(index_file)
+    return cache
+
+
+def save_index(cache):
+    """
+    Write the entry index of the cache to disk
+    """
+    with open(cache['index_file'], 'w') as index_file:
+        json.dump(cache['index'], index_file, indent=4, sort_keys=True)
+
+
+def cache_key(cache, query, params=None):
+    """
+    Get key of a query result, the same query in a new data generation gets a new key
+    """
+    key = json.dumps([query, params, cache['generation']], default=str)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def entry_path(cache, key):
+    """
+    Get path of a cached result from its key
+    """
+    return os.path.join(cache['dir'], '{}.parquet'.format(key))
+
+
+def get(cache, key):
+    """
+    Read a cached query result, its access time is written to disk with the next put or close_cache
+    :return frame: dataframe with the dtypes it was stored with, None on a miss
+    """
+    import pyarrow.parquet as pq
+
+    with cache['lock']:
+        entry = cache['index'].get(key)
+        if entry is None or not os.path.exists(entry_path(cache, key)):
+            cache['stats']['misses'] += 1
+            return None
+        cache['stats']['hits'] += 1
+        entry['last_access'] = time.time()
+    frame = pq.read_table(entry_path(cache, key), memory_map=True).to_pandas()
+    return frame.astype(entry['dtypes'])
+
+
+def put(cache, key, frame):
+    """
+    Store a query result and evict stale and least recently used results
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    with tempfile.NamedTemporaryFile(dir=cache['dir'], suffix='.tmp', delete=False) as temp_file:
+        temp_path = temp_file.name
+    pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), temp_path)
+    os.replace(temp_path, entry_path(cache, key))
+
+    with cache['lock']:
+        cache['index'][key] = {'generation': cache['generation'],
+                               'dtypes': {column: str(dtype) for column, dtype in frame.dtypes.items()},
+                               'size': os.path.getsize(entry_path(cache, key)),
+                               'last_access': time.time()}
+        evict(cache, keep=key)
+        save_index(cache)
+
+
+def evict(cache, keep=None):
+    """
+    Remove results of older data generations, then least recently used results until the cache
+    fits its size limit, called with the cache lock held
+    :param keep: key which must stay cached
+    """
+    entries = sorted(cache['index'].items(), key=lambda item: item[1]['last_access'])
+    total = sum(entry['size'] for key, entry in entries)
+    for key, entry in entries:
+        if key == keep or (entry['generation'] == cache['generation'] and total <= cache['max_bytes']):
+            continue
+        if os.path.exists(entry_path(cache, key)):
+            os.unlink(entry_path(cache, key))
+        del cache['index'][key]
+        cache['stats']['evictions'] += 1
+        total -= entry['size']
+
+
+def close_cache(cache):
+    """
+    Write the access times of cache hits to the index on disk
+    """
+    with cache['lock']:
+        save_index(cache)
+
+
+def print_stats(cache):
+    """
+    Print hit/miss counts of the cache
+    """
+    stats = cache['stats']
+    lookups = stats['hits'] + stats['misses']
+    print('Query cache: {} hits, {} misses ({:.0%} hit rate), {} evictions, generation {}'.format(
+        stats['hits'], stats['misses'], stats['hits'] / lookups if lookups else 0, stats['evictions'],
+        cache['generation']))
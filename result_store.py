@@ -0,0 +1,184 @@
+import pandas as pd
+import checkpoint_store
+import threading
+import json
+import os
+# Result file paths live in paths, which the runner reads without importing pandas
+from paths import result_files, extensions, result_settings, result_path
+
+# Columns stored as numbers in columnar files, values like "1,234" are converted
+numeric_columns = {'unemployment': ['rate'],
+                   'education': ['TOTALREV', 'TFEDREV', 'TSTREV', 'TLOCREV', 'TOTALEXP', 'TCURINST', 'TCURSSVC',
+                                 'TCUROTH', 'TCAPOUT'],
+                   'crime': ['Population_Coverage', 'Violent_crime_total', 'Murder_and_nonnegligent_manslaughter',
+                             'Legacy_rape1', 'Robbery', 'Aggravated_assault', 'Property_crime_total', 'Burglary',
+                             'Larceny-theft', 'Motor_vehicle_theft', 'Violent_Crime_rate',
+                             'Murder_and_nonnegligent_manslaughter_rate', 'Legacy_rape_rate1', 'Robbery_rate',
+                             'Aggravated_assault_rate', 'Property_crime_rate', 'Burglary_rate', 'Larceny-theft_rate',
+                             'Motor_vehicle_theft_rate']}
+
+
+def to_typed_frame(dataset, records):
+    """
+    Convert records into a dataframe with numeric columns stored as numbers
+    """
+    data = records.copy() if isinstance(records, pd.DataFrame) else pd.DataFrame(records)
+    for column in numeric_columns[dataset]:
+        if column in data and not pd.api.types.is_numeric_dtype(data[column]):
+            data[column] = pd.to_numeric(data[column].astype(str).str.replace(',', ''), errors='coerce')
+    return data
+
+
+def write_records(dataset, records, fmt='json', compression='snappy'):
+    """
+    Write records of a dataset into its result file
+    :param records: list of dictionaries or dataframe
+    :param fmt: 'json' keeps the original indented json, 'ndjson' writes one record per line,
+    'parquet' writes typed compressed columns
+    """
+    path = result_path(dataset, fmt)
+    if fmt == 'ndjson':
+        sink = open_sink(dataset)
+        write_partition(sink, records)
+        close_sink(sink)
+    elif fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(to_typed_frame(dataset, records), preserve_index=False)
+        pq.write_table(table, path, compression=compression)
+    elif isinstance(records, pd.DataFrame):
+        records.to_json(path, orient='records')
+    else:
+        with open(path, 'w') as json_file:
+            json.dump(records, json_file, indent=4, sort_keys=True)
+
+
+def read_frame(dataset, fmt='json', columns=None):
+    """
+    Read result file of a dataset into a dataframe
+    :param columns: columns to load, every column if None. Parquet files are memory mapped and
+    only these columns are read.
+    """
+    path = result_path(dataset, fmt)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    if fmt == 'ndjson':
+        data = pd.read_json(path, orient='records', lines=True, dtype=False, convert_dates=False)
+        return data[columns] if columns else data
+    with open(path, encoding='utf-8') as data_file:
+        data = pd.DataFrame(json.loads(data_file.read()), dtype=object)
+    return data[columns] if columns else data
+
+
+def read_records(dataset, fmt='json'):
+    """
+    Read result file of a dataset as list of dictionaries
+    """
+    if fmt == 'parquet':
+        return read_frame(dataset, fmt).to_dict('records')
+    if fmt == 'ndjson':
+        return list(iter_records(dataset, fmt))
+    with open(result_path(dataset, fmt), encoding='utf-8') as data_file:
+        return json.loads(data_file.read())
+
+
+def iter_records(dataset, fmt='json'):
+    """
+    Iterate records of a dataset without loading the whole file: json arrays are parsed incrementally,
+    ndjson files are read one line at a time and parquet files one row group at a time
+    :return: generator of dictionaries
+    """
+    path = result_path(dataset, fmt)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for i in range(parquet_file.num_row_groups):
+            for record in parquet_file.read_row_group(i).to_pandas().to_dict('records'):
+                yield record
+    elif fmt == 'ndjson':
+        with open(path, encoding='utf-8') as data_file:
+            for line in data_file:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        import ijson
+        with open(path, 'rb') as data_file:
+            for record in ijson.items(data_file, 'item', use_float=True):
+                yield record
+
+
+def open_sink(dataset):
+    """
+    Start a new ndjson result file of a dataset which records are appended to while they are scraped
+    :return sink: dictionary with the open file, a lock for scraper threads and the written record count
+    """
+    path = result_path(dataset, 'ndjson')
+    return {'path': path, 'file': open(path, 'w', encoding='utf-8'), 'lock': threading.Lock(), 'records': 0}
+
+
+def write_partition(sink, records):
+    """
+    Append records of a partition to the sink and flush them to disk, so that they survive a crash
+    :param records: list of dictionaries or dataframe
+    """
+    if isinstance(records, pd.DataFrame):
+        lines = records.to_json(orient='records', lines=True)
+        if lines and not lines.endswith('\n'):
+            lines += '\n'
+    else:
+        lines = ''.join(json.dumps(record, sort_keys=True) + '\n' for record in records)
+    with sink['lock']:
+        sink['file'].write(lines)
+        sink['file'].flush()
+        os.fsync(sink['file'].fileno())
+        sink['records'] += len(records)
+
+
+def open_checkpointed_sink(dataset, store, source, partitions):
+    """
+    Start an ndjson result file holding the partitions of a period in the given order. Checkpointed
+    partitions are written right away, every partition saved to the checkpoint store afterwards is
+    appended as soon as all partitions before it are written, so that parallel scrapers produce the
+    same file on every run
+    :param partitions: (year, month) of every partition of the period in result file order
+    :return sink: ndjson sink of the dataset
+    """
+    sink = open_sink(dataset)
+    sink.update({'store': store, 'source': source, 'partitions': list(partitions), 'next': 0,
+                 'ready': checkpoint_store.completed_partitions(store, source), 'order_lock': threading.Lock()})
+    write_ready_partitions(sink)
+
+    def on_saved(saved_source, year, month, records):
+        if saved_source == source:
+            with sink['order_lock']:
+                sink['ready'].add((year, month))
+            write_ready_partitions(sink)
+
+    checkpoint_store.add_listener(store, on_saved)
+    return sink
+
+
+def write_ready_partitions(sink, final=False):
+    """
+    Append the saved partitions which are next in order, partitions saved out of order wait
+    in the checkpoint store until the ones before them are written
+    :param final: also write the partitions after missing ones, used when scraping finished
+    """
+    with sink['order_lock']:
+        partitions = sink['partitions']
+        while sink['next'] < len(partitions) and (final or partitions[sink['next']] in sink['ready']):
+            year, month = partitions[sink['next']]
+            sink['next'] += 1
+            if (year, month) in sink['ready']:
+                write_partition(sink, checkpoint_store.load_partition(sink['store'], sink['source'], year, month))
+
+
+def close_sink(sink):
+    """
+    Write the remaining partitions of a checkpointed sink and close the ndjson result file
+    """
+    if 'partitions' in sink:
+        write_ready_partitions(sink, final=True)
+    sink['file'].close()
+    print('Wrote {} records to {}'.format(sink['records'], sink['path']))
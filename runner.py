@@ -1,11 +1,14 @@
 import os
-import scrape_unemployment_data
-import extract_education_data
-import scrape_crime_data
-import mongodb_upload_data
-import postgresql_upload_data
-import visualize_data
+import sys
+import json
+import time
+import hashlib
+import argparse
+import importlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import yaml
+import paths
 
 # Dependencies file path
 requirement_file = os.path.join(os.getcwd(), r'requirement.txt')
@@ -13,41 +16,337 @@ requirement_file = os.path.join(os.getcwd(), r'requirement.txt')
 # Input.yaml file path
 input_file = os.path.join(os.getcwd(), r'input.yaml')
 
+# Fingerprints of the last successful run of every stage
+state_file = os.path.join(os.getcwd(), r'result\pipeline_state.json')
 
-def main():
+# Stages running at once, the three data producers are independent
+stage_workers = 3
+
+# sql files run by the postgresql stage
+schema_files = [os.path.join(os.getcwd(), name) for name in ('db_schema.sql', 'db_drop_schema.sql', 'db_views.sql')]
+
+
+def result_files(cfg, datasets):
     """
-    Execute end to end project
+    Get paths of the result files of datasets in the configured format
     """
-    # Install all denepedencies
-    os.system("pip install -r {}".format(requirement_file))
+    fmt = paths.result_settings(cfg)['format']
+    return [paths.result_path(dataset, fmt) for dataset in datasets]
 
-    # fetch inputs from input.yaml file
-    with open(input_file, 'r') as ymlfile:
-        cfg = yaml.safe_load(ymlfile)
 
-    if cfg['fetch_data_website']['web_scrape_unemployment']:
-        print("Web scrape Unemployment data from website")
-        # Web scrape Unemployment data
-        scrape_unemployment_data.main()
+def report_files(cfg):
+    """
+    Get path of the visualization report, None when charts are only shown and must always be rendered
+    """
+    settings = cfg.get('visualize_settings') or {}
+    if settings.get('output', 'show') != 'report':
+        return None
+    return [settings.get('report_path', paths.default_report_path)]
+
+
+def mongo_loaded(cfg):
+    """
+    Check whether the mongodb collections of all datasets hold documents
+    """
+    import db_connections
+
+    details = cfg['mongoDB_details']
+    try:
+        db = db_connections.mongo_database(details)
+        return all(db[details[name]].estimated_document_count() > 0
+                   for name in ('unemp_collection_name', 'edu_collection_name', 'crime_collection_name'))
+    except Exception as e:
+        print(e)
+        return False
+
+
+def postgres_loaded(cfg):
+    """
+    Check whether a postgres load finished, every successful load bumps the data generation row
+    """
+    import db_connections
+
+    row = None
+    try:
+        with db_connections.pg_connection(cfg['postgresqlDB_details']) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT generation FROM data_generation")
+            row = cursor.fetchone()
+            cursor.close()
+    except Exception as e:
+        print(e)
+    return row is not None
+
+
+# Pipeline stages in run order. module is imported only when the stage runs, after lists the stages
+# a stage depends on, config the input.yaml sections and inputs the files its fingerprint is computed
+# from. A stage is up to date when its fingerprint did not change since its last successful run and
+# its outputs exist. Database stages have no output files, loaded checks that their data is in place
+stages = {'unemployment': {'module': 'scrape_unemployment_data', 'after': [],
+                           'enabled': lambda cfg: cfg['fetch_data_website']['web_scrape_unemployment'],
+                           'config': ['dataset_links', 'data_period', 'scrape_settings', 'page_readiness',
+                                      'checkpoint', 'result_files'],
+                           'inputs': lambda cfg: [],
+                           'outputs': lambda cfg: result_files(cfg, ['unemployment'])},
+          'education': {'module': 'extract_education_data', 'after': [],
+                        'enabled': lambda cfg: cfg['fetch_data_website']['extract_education'],
+                        'config': ['data_period', 'download_cache', 'education_settings', 'result_files'],
+                        'inputs': lambda cfg: [],
+                        'outputs': lambda cfg: result_files(cfg, ['education'])},
+          'crime': {'module': 'scrape_crime_data', 'after': [],
+                    'enabled': lambda cfg: cfg['fetch_data_website']['web_scrape_crime'],
+                    'config': ['dataset_links', 'data_period', 'scrape_settings', 'page_readiness', 'checkpoint',
+                               'result_files'],
+                    'inputs': lambda cfg: [],
+                    'outputs': lambda cfg: result_files(cfg, ['crime'])},
+          'mongodb': {'module': 'mongodb_upload_data', 'after': ['unemployment', 'education', 'crime'],
+                      'enabled': lambda cfg: True,
+                      'config': ['mongoDB_details', 'result_files'],
+                      'inputs': lambda cfg: result_files(cfg, ['unemployment', 'education', 'crime']),
+                      'outputs': lambda cfg: [],
+                      'loaded': mongo_loaded},
+          'postgresql': {'module': 'postgresql_upload_data', 'after': ['mongodb'],
+                         'enabled': lambda cfg: True,
+                         'config': ['mongoDB_details', 'postgresqlDB_details', 'result_files'],
+                         'inputs': lambda cfg: result_files(cfg, ['unemployment', 'education', 'crime']) +
+                         schema_files,
+                         'outputs': lambda cfg: [],
+                         'loaded': postgres_loaded},
+          'visualize': {'module': 'visualize_data', 'after': ['postgresql'],
+                        'enabled': lambda cfg: True,
+                        'config': ['postgresqlDB_details', 'visualize_settings', 'query_cache'],
+                        'inputs': lambda cfg: [],
+                        'outputs': report_files}}
+
+
+def file_hash(path):
+    """
+    Get sha256 of a file, None if it does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(name, cfg, fingerprints):
+    """
+    Get fingerprint of a stage from its config sections, input files and the fingerprints of the
+    stages it depends on
+    """
+    stage = stages[name]
+    inputs = {'config': {section: cfg.get(section) for section in stage['config']},
+              'files': {path: file_hash(path) for path in stage['inputs'](cfg)},
+              'after': {dependency: fingerprints.get(dependency) for dependency in stage['after']}}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def load_state():
+    """
+    Read the fingerprints of the last successful stage runs
+    """
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r') as file:
+        return json.load(file)
+
+
+def save_state(state):
+    """
+    Write the fingerprints of the last successful stage runs
+    """
+    if not os.path.exists(os.path.dirname(state_file)):
+        os.makedirs(os.path.dirname(state_file))
+    with open(state_file, 'w') as file:
+        json.dump(state, file, indent=4, sort_keys=True)
+
+
+def up_to_date(name, cfg, state, stage_fingerprint):
+    """
+    Check whether a stage ran successfully with the same fingerprint and its outputs still exist
+    """
+    outputs = stages[name]['outputs'](cfg)
+    if outputs is None or state.get(name) != stage_fingerprint:
+        return False
+    if not all(os.path.exists(path) for path in outputs):
+        return False
+    loaded = stages[name].get('loaded')
+    return loaded is None or loaded(cfg)
 
-    if cfg['fetch_data_website']['extract_education']:
-        print("Extract Education data from website")
-        # Extract Education data
-        extract_education_data.main()
 
-    if cfg['fetch_data_website']['extract_education']:
-        print("Web scrape crime rate data from website")
-        # Web scrape crime rate data
-        scrape_crime_data.main()
+def downstream(names):
+    """
+    Get stages together with every stage depending on them
+    """
+    selected = set(names)
+    for name, stage in stages.items():
+        if selected.intersection(stage['after']):
+            selected.add(name)
+    return selected
+
+
+def run_stage(name, cfg):
+    """
+    Import the module of a stage and run it, the main function of a stage raises when a step failed
+    :return: run time in seconds
+    """
+    start = time.time()
+    print("Running stage {}".format(name))
+    importlib.import_module(stages[name]['module']).main(cfg)
+    return time.time() - start
+
+
+def run_pipeline(cfg, selected=None, forced=None):
+    """
+    Run the pipeline stages as soon as the stages they depend on finished. Stages which are
+    up to date are skipped, stages after a failed stage are not run.
+    :param selected: stages to run, every stage if None. Other stages count as finished
+    :param forced: selected stages which run even when they are up to date
+    :return: names of the failed stages
+    """
+    selected = set(stages) if selected is None else set(selected)
+    forced = set(forced or [])
+    state = load_state()
+    fingerprints = {}
+    pending = list(stages)
+    finished = set()
+    failed = set()
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=stage_workers) as executor:
+        while pending or running:
+            for name in list(pending):
+                after = stages[name]['after']
+                if failed.intersection(after):
+                    pending.remove(name)
+                    failed.add(name)
+                    print("Skipping stage {}, a stage it depends on failed".format(name))
+                    continue
+                if not finished.issuperset(after):
+                    continue
+                pending.remove(name)
+                if name not in selected:
+                    fingerprints[name] = state.get(name)
+                    finished.add(name)
+                    continue
+                fingerprints[name] = fingerprint(name, cfg, fingerprints)
+                if not stages[name]['enabled'](cfg):
+                    print("Stage {} is disabled in input.yaml".format(name))
+                    fingerprints[name] = state.get(name)
+                    finished.add(name)
+                elif name not in forced and up_to_date(name, cfg, state, fingerprints[name]):
+                    print("Stage {} is up to date".format(name))
+                    finished.add(name)
+                else:
+                    running[executor.submit(run_stage, name, cfg)] = name
+
+            if not running:
+                continue
+            done, not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    print("Stage {} finished in {:.1f} s".format(name, future.result()))
+                    finished.add(name)
+                    state[name] = fingerprints[name]
+                    save_state(state)
+                except Exception as e:
+                    print("Stage {} failed: {}".format(name, e))
+                    failed.add(name)
+                    # a failed run may have left partial data, the next run must not skip the stage
+                    if state.pop(name, None) is not None:
+                        save_state(state)
+    return failed
+
+
+def load_config(path):
+    """
+    Read input.yaml once, every stage gets the parsed config
+    """
+    with open(path, 'r') as ymlfile:
+        return yaml.safe_load(ymlfile)
+
+
+def install_requirements():
+    """
+    Install all dependencies of the project
+    """
+    return subprocess.call([sys.executable, '-m', 'pip', 'install', '-r', requirement_file])
+
+
+def add_run_options(parser, defaults=True):
+    """
+    Add the options of the run command to a parser
+    :param defaults: without defaults the options keep the values given before the command
+    """
+    default = None if defaults else argparse.SUPPRESS
+    parser.add_argument('--only', nargs='+', choices=list(stages), default=default, help='run only these stages')
+    parser.add_argument('--from', dest='from_stage', choices=list(stages), default=default,
+                        help='run this stage and every stage after it')
+    parser.add_argument('--force', action='store_true', default=False if defaults else argparse.SUPPRESS,
+                        help='run stages even when they are up to date')
+
+
+def create_parser():
+    """
+    Create the command line parser, run is the default command and its options are also accepted
+    without a command
+    """
+    parser = argparse.ArgumentParser(description='USA unemployment, education and crime data pipeline')
+    parser.add_argument('--config', default=input_file, help='path of input.yaml')
+    add_run_options(parser)
+    commands = parser.add_subparsers(dest='command')
+
+    run_parser = commands.add_parser('run', help='run the pipeline, skipping stages whose inputs did not change')
+    add_run_options(run_parser, defaults=False)
+
+    for name in stages:
+        commands.add_parser(name, help='run the {} stage'.format(name))
+    commands.add_parser('dashboard', help='serve the interactive dashboard')
+    commands.add_parser('install', help='install the dependencies of requirement.txt')
+    return parser
+
+
+def main(argv=None):
+    """
+    Execute end to end project or a single stage of it
+    """
+    args = create_parser().parse_args(argv)
+    if args.command is None:
+        args.command = 'run'
+    if args.command == 'install':
+        return install_requirements()
+
+    # fetch inputs from input.yaml file
+    cfg = load_config(args.config)
+
+    if args.command == 'dashboard':
+        import dashboard
+        dashboard.main(cfg)
+        return 0
 
-    # Upload data into mongoDB
-    mongodb_upload_data.main()
+    # stages named on the command line always run, stages after a --from stage only when their inputs changed
+    selected = None
+    forced = []
+    if args.command in stages:
+        selected = forced = [args.command]
+    elif args.only:
+        selected = forced = args.only
+    elif args.from_stage:
+        selected = downstream([args.from_stage])
+        forced = [args.from_stage]
+    if args.force:
+        forced = selected or list(stages)
+    failed = run_pipeline(cfg, selected, forced)
 
-    # Upload data into postgresql database
-    postgresql_upload_data.main()
+    # Report usage of the shared database connection pools
+    if 'db_connections' in sys.modules:
+        sys.modules['db_connections'].print_pool_stats()
+    return 1 if failed else 0
 
-    # Analyse and visualize data
-    visualize_data.main()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,41 +1,36 @@
 from selenium import webdriver
 from selenium.webdriver.support.ui import Select
-import json
+import http_scrape_engine
+import table_extraction
+import page_readiness
+import checkpoint_store
+import result_store
 import os
 import yaml
-import re
 
 # Input.yaml file path
 input_file = os.path.join(os.getcwd(), r'input.yaml')
 
-# fetch inputs from input.yaml file
-with open(input_file, 'r') as ymlfile:
-    cfg = yaml.safe_load(ymlfile)
-
-url = cfg['dataset_links']['crime_data_link']
-start_year = cfg['data_period']['start_year']
-end_year = cfg['data_period']['end_year']
-
 # Selenium driver details
 selenium_driver_path = os.path.join(os.getcwd(), r'chromedriver_win32\chromedriver.exe')
 
-# Path of result json file
-json_file_path = os.path.join(os.getcwd(), r'result\CrimeDatabyState.json')
+# Source name of crime data in the checkpoint store
+checkpoint_source = 'crime'
 
-def fillDriverDetails(driver):
+def fillDriverDetails(driver, url):
     """
     Method to fill details in the selenium driver
     """
     driver.get(url)
 
 
-def fillOptions(year, driver):
+def fillOptions(year, driver, firstYear):
     """
-    Selecting the options in the required tables in url
+    Selecting the options in the required tables in url, states and crime variables are selected for firstYear only
     """
     # time.sleep(1)
     # Selecting the States variables from the dropdown
-    if (year == start_year):
+    if (year == firstYear):
         elementStates = driver.find_element_by_xpath('//*[@id="states"]')
         drpStates = Select(elementStates)
         for i in range(1, 52):  # state (1 - 52)
@@ -63,59 +58,130 @@ def scrapeTable(year, driver):
     """
     Method to scrape the table details and filling in the dictionary
     """
-    keys = ['Population_Coverage', 'Violent_crime_total', 'Murder_and_nonnegligent_manslaughter',
-            'Legacy_rape1', 'Robbery', 'Aggravated_assault', 'Property_crime_total', 'Burglary', 'Larceny-theft',
-            'Motor_vehicle_theft', 'Violent_Crime_rate', 'Murder_and_nonnegligent_manslaughter_rate',
-            'Legacy_rape_rate1', 'Robbery_rate', 'Aggravated_assault_rate', 'Property_crime_rate', 'Burglary_rate',
-            'Larceny-theft_rate', 'Motor_vehicle_theft_rate']
-    dict = {}
-    data = []
-
-    for i in range(5, 55):  # 51 states (5-55)
-        xpath = '/html/body/div[2]/table/tbody/tr[{}]'.format(i)
-        values = str(driver.find_element_by_xpath(xpath).text)
-        r = re.compile("([a-zA-Z ]+)([0-9,. ]+)")
-        match = r.match(values)
-        dict['State'] = match.group(1)
-        list = match.group(2).strip().split()
-        for j in range(len(keys)):
-            dict[keys[j]] = list[j]
-        dict['Year'] = str(year)
-        data.append(dict.copy())
-    return data
+    # Fetching the whole result table in one round-trip, state rows are 5-55
+    rows = table_extraction.extract_table_cells(driver, table_extraction.crime_table_xpath)
+    return table_extraction.parse_crime_rows(rows, str(year))
 
 
-def scrapCrimeDataByYear(driver):
+def scrapCrimeDataByYear(driver, url, years, store, readiness_settings=None):
     """
-    Method that will call all methods in order to scrap crime data from provided url and generating json out of teh data
+    Method that will call all methods in order to scrap crime data from provided url, every scraped year is checkpointed
     """
-    final_data = []
-    for year in range(start_year, end_year + 1):  # 2017
+    tracker = page_readiness.create_tracker(readiness_settings)
+    for year in years:
         # Calling method to fill Selenium driver details
-        fillDriverDetails(driver)
+        fillDriverDetails(driver, url)
 
         # Calling method to fill details in website
-        fillOptions(year, driver)
-        # time.sleep(1)
+        previous = driver.find_element_by_tag_name('html')
+        fillOptions(year, driver, years[0])
+
+        # Wait until the result page replaced the search form and has all state rows
+        page_readiness.wait_for_table(driver, tracker, str(year), table_extraction.crime_table_xpath,
+                                      table_extraction.crime_rows.stop, previous=previous)
+
         # Calling method to scrape data from the generated result after fillOptions() method
         data = scrapeTable(year, driver)
-        final_data.extend(data.copy())
+        checkpoint_store.save_partition(store, checkpoint_source, year, checkpoint_store.whole_year, data)
 
     # Stopping the selenium browser
     driver.quit()
+    print(page_readiness.summarize_timings(tracker))
+
+
+def scrapCrimeDataByHttp(url, years, store, pool_size=10):
+    """
+    Method to scrap crime data by posting the form over a pooled HTTP session, without a browser
+    """
+    session = http_scrape_engine.create_session(pool_size)
+
+    try:
+        # The form is read once and posted for every year
+        form = http_scrape_engine.load_form(session, url, 'year')
+        for year in years:
+            rows = http_scrape_engine.fetch_crime_rows(session, form, year)
+            data = table_extraction.parse_crime_rows(rows, str(year))
+            checkpoint_store.save_partition(store, checkpoint_source, year, checkpoint_store.whole_year, data)
+    finally:
+        # Release pooled connections even if a year fails
+        session.close()
+
 
-    # Store the scrapped data into json file
-    with open(json_file_path, 'w') as json_file:
-        json.dump(final_data, json_file, indent=4, sort_keys=True)
+def pendingYears(store, start_year, end_year):
+    """
+    Method to get the years of the data period which are not checkpointed yet
+    """
+    completed = checkpoint_store.completed_partitions(store, checkpoint_source)
+    return [year for year in range(start_year, end_year + 1) if (year, checkpoint_store.whole_year) not in completed]
+
+
+def collectCrimeData(store, start_year, end_year):
+    """
+    Method to read checkpointed years of the data period in year order
+    """
+    final_data = []
+    for year in range(start_year, end_year + 1):
+        final_data.extend(checkpoint_store.load_partition(store, checkpoint_source, year, checkpoint_store.whole_year))
+    return final_data
+
+
+def writeCrimeData(final_data, result_settings):
+    """
+    Method to store the scrapped data into result file
+    :param result_settings: format and compression of the result file
+    """
+    result_store.write_records('crime', final_data, result_settings['format'], result_settings['compression'])
 
 
-def main():
+def main(cfg=None):
     """
     Start web scrapping data from the given website
+    :param cfg: parsed input.yaml, read from input_file if None
     """
-    driver = webdriver.Chrome(executable_path=selenium_driver_path)
-    # fetch data
-    scrapCrimeDataByYear(driver)
+    # fetch inputs from input.yaml file unless the runner passed them
+    if cfg is None:
+        with open(input_file, 'r') as ymlfile:
+            cfg = yaml.safe_load(ymlfile)
+
+    url = cfg['dataset_links']['crime_data_link']
+    start_year = cfg['data_period']['start_year']
+    end_year = cfg['data_period']['end_year']
+    scrape_settings = cfg.get('scrape_settings', {})
+    checkpoint_settings = cfg.get('checkpoint', {})
+    result_settings = result_store.result_settings(cfg)
+
+    # Only years missing from the checkpoint store are scraped
+    store = checkpoint_store.open_store(checkpoint_settings.get('path', checkpoint_store.default_store_file))
+    checkpoint_store.apply_invalidations(store, checkpoint_source, checkpoint_settings.get('invalidate'))
+    years = pendingYears(store, start_year, end_year)
+    print('{} years to scrape'.format(len(years)))
+
+    sink = None
+    try:
+        # ndjson result files are written while scraping, one year at a time
+        if result_settings['format'] == 'ndjson':
+            sink = result_store.open_checkpointed_sink('crime', store, checkpoint_source,
+                                                        [(year, checkpoint_store.whole_year)
+                                                         for year in range(start_year, end_year + 1)])
+
+        if not years:
+            print('Crime data is up to date')
+        elif scrape_settings.get('engine', 'selenium') == 'http':
+            # fetch data without a browser
+            scrapCrimeDataByHttp(url, years, store, scrape_settings.get('http_pool_size', 10))
+        else:
+            driver = webdriver.Chrome(executable_path=selenium_driver_path)
+            # fetch data
+            scrapCrimeDataByYear(driver, url, years, store, cfg.get('page_readiness'))
+
+        if not sink:
+            # Store the scrapped data of the whole period into result file
+            writeCrimeData(collectCrimeData(store, start_year, end_year), result_settings)
+    finally:
+        # The ndjson file keeps the scraped years flushed to disk even if scraping failed
+        if sink:
+            result_store.close_sink(sink)
+        checkpoint_store.close_store(store)
 
 
 if __name__ == "__main__":
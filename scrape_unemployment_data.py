@@ -1,7 +1,11 @@
 from selenium.webdriver.support.ui import Select
 from selenium import webdriver
-import json
-import time
+from concurrent.futures import ThreadPoolExecutor
+import http_scrape_engine
+import table_extraction
+import page_readiness
+import checkpoint_store
+import result_store
 import os
 import yaml
 
@@ -12,99 +16,253 @@ input_file = os.path.join(os.getcwd(), r'input.yaml')
 months = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
           'November', 'December']
 
-# Set path of the result json file and chrome driver(required for selenium)
-result_json_file = os.path.join(os.getcwd(), r'result\unemployment-data.json')
+# Set path of chrome driver(required for selenium)
 chrome_driver_path = os.path.join(os.getcwd(), r'chromedriver_win32\chromedriver.exe')
 
+# Source name of unemployment data in the checkpoint store
+checkpoint_source = 'unemployment'
 
-def fill_options(driver, start_year, end_year):
+
+def create_driver(headless=False):
+    """
+    Create a chrome driver, optionally without a visible browser window
+    :param headless: run chrome in headless mode
+    :return driver: selenium chrome driver
+    """
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument('--headless')
+        options.add_argument('--disable-gpu')
+    return webdriver.Chrome(executable_path=chrome_driver_path, options=options)
+
+
+def submit_period(driver, year, month, tracker):
+    """
+    Select year and month in the drop downs, submit the form and wait for the result table
+    :param tracker: page readiness settings and wait timings
+    """
+    # Selecting year from drop down
+    elementYear = driver.find_element_by_xpath('//*[@id="year"]')
+    drpYear = Select(elementYear)
+    drpYear.select_by_visible_text(str(year))
+
+    # Selecting month from drop down
+    elementMonth = driver.find_element_by_xpath('// *[ @ id = "period"]')
+    drpMonth = Select(elementMonth)
+    drpMonth.select_by_visible_text(month)
+
+    # Submitting the selections to generate data
+    previous = page_readiness.find_table(driver, table_extraction.unemployment_table_xpath)
+    submitBtn = driver.find_element_by_xpath('//*[@id="btn_sumbit"]')
+    submitBtn.click()
+
+    # Wait until the table of the selected month is rendered
+    page_readiness.wait_for_table(driver, tracker, '{} {}'.format(month, year),
+                                  table_extraction.unemployment_table_xpath,
+                                  table_extraction.unemployment_rows.stop, previous=previous,
+                                  expected_text='{} {}'.format(month, year))
+
+
+def fill_options(driver, periods, tracker, store):
+    """
+    Selecting the options in the required tables, every scraped month is checkpointed
+    :param periods: list of (year, month) to scrape
+    """
+    for year, month in periods:
+        # Selecting the year and month from drop down
+        submit_period(driver, year, month, tracker)
+
+        # Calling the scraper method to scrape data of a month
+        unemployment_data_list = scrape_table(driver, month, str(year))
+        save_period(store, year, month, unemployment_data_list)
+
+
+def shard_periods(periods, workers):
+    """
+    Split the (year, month) periods across workers
+    :return shards: list of (year, month) lists, one per worker
+    """
+    # Round robin so that every worker gets a similar mix of years
+    shards = [periods[i::workers] for i in range(workers)]
+    return [shard for shard in shards if shard]
+
+
+def scrape_periods(url, periods, headless, tracker, store):
     """
-    Selecting the options in the required tables
+    Scrape the given (year, month) periods with a dedicated browser session
     """
+    driver = create_driver(headless)
+    try:
+        driver.get(url)
+        for year, month in periods:
+            submit_period(driver, year, month, tracker)
+            save_period(store, year, month, scrape_table(driver, month, str(year)))
+    finally:
+        # Stop selenium browser even if a page fails
+        driver.quit()
+
+
+def fill_options_parallel(url, periods, workers, tracker, store, headless=True):
+    """
+    Scrape the given periods with a pool of browser sessions
+    """
+    shards = shard_periods(periods, workers)
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [executor.submit(scrape_periods, url, shard, headless, tracker, store) for shard in shards]
+        for future in futures:
+            # Raise errors of failed workers, their finished months stay checkpointed
+            future.result()
+
+
+def month_number(month):
+    """
+    Get number of a month name, 1 for January
+    """
+    return months.index(month) + 1
+
 
-    # Selecting the year from drop down
+def save_period(store, year, month, records):
+    """
+    Checkpoint records of a scraped month
+    """
+    checkpoint_store.save_partition(store, checkpoint_source, year, month_number(month), records)
+
+
+def pending_periods(store, start_year, end_year):
+    """
+    Get the (year, month) periods of the given range which are not checkpointed yet
+    """
+    completed = checkpoint_store.completed_partitions(store, checkpoint_source)
+    return [(year, month) for year in range(start_year, end_year + 1) for month in months
+            if (year, month_number(month)) not in completed]
+
+
+def collect_records(store, start_year, end_year):
+    """
+    Read checkpointed months of the given range in year and month order
+    :return records: unemployment data of every month in the given period
+    """
     records = []
     for year in range(start_year, end_year + 1):
-        time.sleep(1)
-        # Selecting the month from drop down and iterating to scrap data
         for month in months:
-            # Selecting year from drop down
-            elementYear = driver.find_element_by_xpath('//*[@id="year"]')
-            drpYear = Select(elementYear)
-            drpYear.select_by_visible_text(str(year))
-
-            # Selecting month from drop down
-            elementMonth = driver.find_element_by_xpath('// *[ @ id = "period"]')
-            drpMonth = Select(elementMonth)
-            drpMonth.select_by_visible_text(month)
-
-            # Submitting the selections to generate data
-            submitBtn = driver.find_element_by_xpath('//*[@id="btn_sumbit"]')
-            submitBtn.click()
+            records.extend(checkpoint_store.load_partition(store, checkpoint_source, year, month_number(month)))
+    return records
 
-            # Calling the scraper method to scrape data of a month
-            unemployment_data_list = scrape_table(driver, month, str(year))
-            records.extend(unemployment_data_list)
 
-    # Write data into json file
-    with open(result_json_file, 'w') as json_file:
-        json.dump(records, json_file, indent=4, sort_keys=True)
+def write_records(records, settings):
+    """
+    Write unemployment data into result file
+    :param settings: result file format and compression
+    """
+    result_store.write_records('unemployment', records, settings['format'], settings['compression'])
 
 
 def scrape_table(driver, month, year):
     """
     Scrapping data from the result of fill_options
     """
-    # Add wait time to reload webpage
-    time.sleep(2)
-    
-    record_list = []
-
-    # Fetching data from the result table
-    for i in range(1, 53):  # data available in 53 rows
-        monthly_dict = {}
-        xpath = '//*[@id="tb_data"]/tbody/tr[{}]'.format(i)
-        values = str(driver.find_element_by_xpath(xpath).text)
-        key_value = values.strip().split()
-        if len(key_value) > 3:
-            monthly_dict['state'] = '{} {} {}'.format(key_value[0], key_value[1], key_value[2])
-            monthly_dict['rate'] = key_value[3]
-        elif len(key_value) > 2:
-            monthly_dict['state'] = '{} {}'.format(key_value[0], key_value[1])
-            monthly_dict['rate'] = key_value[2]
-        else:
-            monthly_dict['state'] = '{}'.format(key_value[0])
-            monthly_dict['rate'] = key_value[1]
-        monthly_dict['month'] = month
-        monthly_dict['year'] = year
-        # Print row data
-        print(monthly_dict)
-        record_list.append(monthly_dict)
+    # Fetching the whole result table in one round-trip
+    rows = table_extraction.extract_table_cells(driver, table_extraction.unemployment_table_xpath)
+    record_list = table_extraction.parse_unemployment_rows(rows, month, year)
+    print('Scraped {} rows for {} {}'.format(len(record_list), month, year))
     return record_list
 
 
-def main():
+def fill_options_http(url, periods, workers, store, pool_size=10):
+    """
+    Scrape the given periods by posting the form over a pooled HTTP session, without a browser
+    :param pool_size: number of kept-alive connections of the session
+    """
+    session = http_scrape_engine.create_session(pool_size)
+
+    def scrape_period(period):
+        year, month = period
+        rows = http_scrape_engine.fetch_unemployment_rows(session, form, year, month)
+        save_period(store, year, month, table_extraction.parse_unemployment_rows(rows, month, str(year)))
+
+    try:
+        form = http_scrape_engine.load_form(session, url, 'year')
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            # Consume results to raise errors of failed months
+            list(executor.map(scrape_period, periods))
+    finally:
+        # Release pooled connections even if a month fails
+        session.close()
+
+
+def scrape(url, periods, scrape_settings, tracker, store):
+    """
+    Scrape the given periods with the engine selected in scrape_settings
+    """
+    workers = scrape_settings.get('unemployment_workers', 1)
+    headless = scrape_settings.get('headless', False)
+
+    if scrape_settings.get('engine', 'selenium') == 'http':
+        # Post form parameters directly, no browser required
+        fill_options_http(url, periods, workers, store, scrape_settings.get('http_pool_size', 10))
+    elif workers > 1:
+        # Shard the periods across a pool of browser sessions
+        fill_options_parallel(url, periods, workers, tracker, store, headless)
+    else:
+        # Get driver object for selenium
+        driver = create_driver(headless)
+
+        # Get unemployment data from given URL
+        driver.get(url)
+        fill_options(driver, periods, tracker, store)
+
+        # Stop selenium browser
+        driver.quit()
+
+
+def main(cfg=None):
     """
     start web scrapping data from given website
+    :param cfg: parsed input.yaml, read from input_file if None
     """
 
-    # fetch inputs from input.yaml file
-    with open(input_file, 'r') as ymlfile:
-        cfg = yaml.safe_load(ymlfile)
+    # fetch inputs from input.yaml file unless the runner passed them
+    if cfg is None:
+        with open(input_file, 'r') as ymlfile:
+            cfg = yaml.safe_load(ymlfile)
 
     url = cfg['dataset_links']['unemlpoyment_data_link']
     start_year = cfg['data_period']['start_year']
     end_year = cfg['data_period']['end_year']
+    scrape_settings = cfg.get('scrape_settings', {})
+    tracker = page_readiness.create_tracker(cfg.get('page_readiness'))
+
+    # Only months missing from the checkpoint store are scraped
+    checkpoint = cfg.get('checkpoint', {})
+    store = checkpoint_store.open_store(checkpoint.get('path', checkpoint_store.default_store_file))
+    checkpoint_store.apply_invalidations(store, checkpoint_source, checkpoint.get('invalidate'), month_number)
+    periods = pending_periods(store, start_year, end_year)
+    print('{} months to scrape'.format(len(periods)))
+
+    settings = result_store.result_settings(cfg)
+    sink = None
+    try:
+        # ndjson result files are written while scraping, one month at a time
+        if settings['format'] == 'ndjson':
+            sink = result_store.open_checkpointed_sink('unemployment', store, checkpoint_source,
+                                                        [(year, month_number(month))
+                                                         for year in range(start_year, end_year + 1)
+                                                         for month in months])
 
-    # Get driver object for selenium
-    driver = webdriver.Chrome(executable_path=chrome_driver_path)
+        if periods:
+            scrape(url, periods, scrape_settings, tracker, store)
 
-    # Get unemployment data from given URL and write into result JSON file
-    driver.get(url)
-    fill_options(driver, start_year, end_year)
+        if tracker['timings']:
+            print(page_readiness.summarize_timings(tracker))
 
-    # Stop selenium browser
-    driver.quit()
+        if not sink:
+            # Write unemployment data of the whole period into result file
+            write_records(collect_records(store, start_year, end_year), settings)
+    finally:
+        # The ndjson file keeps the scraped months flushed to disk even if scraping failed
+        if sink:
+            result_store.close_sink(sink)
+        checkpoint_store.close_store(store)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+# Measures by fact table. Additive measures can be summed again from a rollup at a finer grain
+measures = {'avg_unemployment_rate': {'fact': 'unemployment_rate', 'sql': 'avg(unemployment_rate.unemployment_rate)',
+                                      'additive': False},
+            'total_crime': {'fact': 'crime_rate',
+                            'sql': 'sum(crime_rate.motor_vehicle_theft + crime_rate.larceny_theft + '
+                                   'crime_rate.burglary + crime_rate.property_crime_total + '
+                                   'crime_rate.aggravated_assault + crime_rate.robbery + crime_rate.legacy_rape1 + '
+                                   'crime_rate.murder_and_nonnegligent_manslaughter + crime_rate.violent_crime_total)',
+                            'additive': True},
+            'robbery': {'fact': 'crime_rate', 'sql': 'sum(crime_rate.robbery)', 'additive': True},
+            'violent_crime_total': {'fact': 'crime_rate', 'sql': 'sum(crime_rate.violent_crime_total)',
+                                    'additive': True},
+            'property_crime_total': {'fact': 'crime_rate', 'sql': 'sum(crime_rate.property_crime_total)',
+                                     'additive': True},
+            'total_revenue': {'fact': 'education_expenditure', 'sql': 'sum(education_expenditure.total_revenue)',
+                              'additive': True},
+            'total_expenditure': {'fact': 'education_expenditure',
+                                  'sql': 'sum(education_expenditure.total_expenditure)', 'additive': True}}
+
+# Dimensions with their column on the fact tables, facts None means every fact table has it
+dimensions = {'year': {'sql': '{fact}.year', 'dtype': 'int64', 'facts': None},
+              'state': {'sql': 'state.name', 'dtype': 'object', 'facts': None},
+              'month': {'sql': '{fact}.month', 'dtype': 'int64', 'facts': ['unemployment_rate']}}
+
+# Materialized views of db_views.sql, used instead of the fact table when they hold every requested
+# measure and dimension. grain lists the dimensions of a rollup row
+rollups = [{'table': 'crime_year_totals', 'grain': ['year'], 'measures': {'total_crime': 'total_crime'}},
+           {'table': 'education_year_totals', 'grain': ['year'],
+            'measures': {'total_revenue': 'total_revenue', 'total_expenditure': 'total_expenditure'}},
+           {'table': 'unemployment_state_year', 'grain': ['state', 'year'],
+            'measures': {'avg_unemployment_rate': 'avg_unemployment_rate'}},
+           {'table': 'crime_state_totals', 'grain': ['state', 'year'],
+            'measures': {'total_crime': 'total_crime', 'robbery': 'robbery',
+                         'violent_crime_total': 'violent_crime_total',
+                         'property_crime_total': 'property_crime_total'}}]
+
+# Filter operators and their sql, the value is passed as query parameter
+operators = {'=': '{} = %s', '!=': '{} <> %s', '<': '{} < %s', '<=': '{} <= %s', '>': '{} > %s', '>=': '{} >= %s',
+             'in': '{} = ANY(%s)', 'between': '{} BETWEEN %s AND %s'}
+
+
+def find_rollup(names, dims):
+    """
+    Find the smallest rollup answering measures by dimensions, rollups of a non additive measure
+    only answer queries at their own grain
+    :param names: measure names of one fact table
+    :param dims: requested and filtered dimension names
+    :return: rollup or None
+    """
+    for rollup in rollups:
+        if not set(names) <= set(rollup['measures']) or not set(dims) <= set(rollup['grain']):
+            continue
+        if all(measures[name]['additive'] for name in names) or set(dims) == set(rollup['grain']):
+            return rollup
+    return None
+
+
+def compile_filters(filters, column_sql):
+    """
+    Compile filters to a WHERE clause
+    :param filters: list of (dimension, operator, value), between takes a (low, high) value
+    :param column_sql: function giving the sql column of a dimension
+    :return: where clause and its parameters
+    """
+    clauses = []
+    params = []
+    for dimension, operator, value in filters:
+        if operator not in operators:
+            raise ValueError('Unknown filter operator {}'.format(operator))
+        clauses.append(operators[operator].format(column_sql(dimension)))
+        if operator == 'between':
+            params.extend(value)
+        else:
+            params.append(list(value) if operator == 'in' else value)
+    if not clauses:
+        return '', params
+    return ' WHERE ' + ' AND '.join(clauses), params
+
+
+def compile_fact_query(fact, names, dims, filters):
+    """
+    Compile the aggregation of measures of one fact table, read from a rollup if one holds them
+    :return: sql and its parameters
+    """
+    filter_dims = [dimension for dimension, operator, value in filters]
+    rollup = find_rollup(names, dims + filter_dims)
+    if rollup:
+        aggregate = {name: ('sum({})' if measures[name]['additive'] else 'avg({})').format(rollup['measures'][name])
+                     for name in names}
+        source = rollup['table']
+        column_sql = lambda dimension: dimension
+    else:
+        aggregate = {name: measures[name]['sql'] for name in names}
+        source = fact
+        if 'state' in dims + filter_dims:
+            source += ' JOIN state ON {0}.state_id = state.state_id'.format(fact)
+        column_sql = lambda dimension: dimensions[dimension]['sql'].format(fact=fact)
+
+    where, params = compile_filters(filters, column_sql)
+    select = [column_sql(dimension) if column_sql(dimension) == dimension else
+              '{} AS {}'.format(column_sql(dimension), dimension) for dimension in dims]
+    select += ['{} AS {}'.format(aggregate[name], name) for name in names]
+    sql = 'SELECT {} FROM {}{}'.format(', '.join(select), source, where)
+    if dims:
+        sql += ' GROUP BY {}'.format(', '.join(column_sql(dimension) for dimension in dims))
+    return sql, params
+
+
+def compile_query(names, dims, filters=None):
+    """
+    Compile measures by dimensions into one aggregated query. Measures of different fact tables are
+    aggregated separately and joined on the dimensions, so rows are never counted twice.
+    :param names: measure names, e.g. ['total_crime', 'total_expenditure']
+    :param dims: dimension names, e.g. ['year']
+    :param filters: list of (dimension, operator, value), e.g. [('state', '=', 'Alabama')]
+    :return: sql, its parameters and dict of result column to dtype
+    """
+    filters = filters or []
+    for name in names:
+        if name not in measures:
+            raise ValueError('Unknown measure {}'.format(name))
+    for dimension in list(dims) + [dimension for dimension, operator, value in filters]:
+        if dimension not in dimensions:
+            raise ValueError('Unknown dimension {}'.format(dimension))
+
+    facts = {}
+    for name in names:
+        facts.setdefault(measures[name]['fact'], []).append(name)
+    for fact in facts:
+        for dimension in list(dims) + [dimension for dimension, operator, value in filters]:
+            if dimensions[dimension]['facts'] is not None and fact not in dimensions[dimension]['facts']:
+                raise ValueError('{} has no dimension {}'.format(fact, dimension))
+
+    parts = [compile_fact_query(fact, fact_names, list(dims), filters) for fact, fact_names in facts.items()]
+    if len(parts) == 1:
+        sql, params = parts[0]
+    else:
+        join = ' FULL JOIN {{}} USING ({})'.format(', '.join(dims)) if dims else ' CROSS JOIN {}'
+        sql = 'SELECT {} FROM ({}) AS part0'.format(', '.join(list(dims) + list(names)), parts[0][0])
+        params = list(parts[0][1])
+        for i, (part_sql, part_params) in enumerate(parts[1:], 1):
+            sql += join.format('({}) AS part{}'.format(part_sql, i))
+            params += part_params
+    if dims:
+        sql += ' ORDER BY {}'.format(', '.join(dims))
+
+    dtypes = {dimension: dimensions[dimension]['dtype'] for dimension in dims}
+    dtypes.update(dict.fromkeys(names, 'float64'))
+    return sql, params, dtypes
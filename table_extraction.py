@@ -0,0 +1,73 @@
+# Result table of the BLS MapToolServlet page and rows holding state data
+unemployment_table_xpath = '//*[@id="tb_data"]'
+unemployment_rows = slice(0, 52)
+
+# Result table of the UCR OneYearofData page and rows holding state data
+crime_table_xpath = '/html/body/div[2]/table'
+crime_rows = slice(4, 54)
+
+# Crime table columns following the state name
+crime_keys = ['Population_Coverage', 'Violent_crime_total', 'Murder_and_nonnegligent_manslaughter',
+              'Legacy_rape1', 'Robbery', 'Aggravated_assault', 'Property_crime_total', 'Burglary', 'Larceny-theft',
+              'Motor_vehicle_theft', 'Violent_Crime_rate', 'Murder_and_nonnegligent_manslaughter_rate',
+              'Legacy_rape_rate1', 'Robbery_rate', 'Aggravated_assault_rate', 'Property_crime_rate', 'Burglary_rate',
+              'Larceny-theft_rate', 'Motor_vehicle_theft_rate']
+
+# Collect text of every cell of every row of a table in a single browser round-trip
+table_cells_script = """
+var table = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null)
+    .singleNodeValue;
+if (!table) { return []; }
+var body = table.tBodies.length ? table.tBodies[0] : table;
+var rows = [];
+for (var i = 0; i < body.rows.length; i++) {
+    var cells = [];
+    for (var j = 0; j < body.rows[i].cells.length; j++) {
+        cells.push(body.rows[i].cells[j].innerText.trim());
+    }
+    rows.push(cells);
+}
+return rows;
+"""
+
+
+def extract_table_cells(driver, table_xpath):
+    """
+    Read all cells of a table body with one execute_script call
+    :return rows: list of rows, each a list of cell texts
+    """
+    return driver.execute_script(table_cells_script, table_xpath)
+
+
+def page_table_cells(page, table_xpath):
+    """
+    Read all cells of a table body from a parsed lxml page
+    :return rows: list of rows, each a list of cell texts
+    """
+    table = page.xpath(table_xpath)[0]
+    # Browsers add tbody while parsing, raw html may not have it
+    return [[cell.text_content().strip() for cell in row.xpath('./th | ./td')]
+            for row in table.xpath('./tr | ./tbody/tr')]
+
+
+def parse_unemployment_rows(rows, month, year):
+    """
+    Convert unemployment table rows into records, state name and rate are read by column position
+    :return records: list of dictionaries with state, rate, month and year
+    """
+    return [{'state': cells[0], 'rate': cells[1], 'month': month, 'year': year}
+            for cells in rows[unemployment_rows]]
+
+
+def parse_crime_rows(rows, year):
+    """
+    Convert crime table rows into records, state name and values are read by column position
+    :return records: list of dictionaries with state, year and every crime column
+    """
+    records = []
+    for cells in rows[crime_rows]:
+        record = dict(zip(crime_keys, cells[1:len(crime_keys) + 1]))
+        record['State'] = cells[0]
+        record['Year'] = year
+        records.append(record)
+    return records
@@ -3,116 +3,221 @@ import os
 import pandas as pd
 from tabulate import tabulate
 import psycopg2 as pg
+import db_connections
+import paths
+import chart_downsampling
+import query_cache
+import semantic_layer
 import plotly.express as px
 import yaml
 import plotly.graph_objects as go
+import plotly.offline
+from concurrent.futures import ThreadPoolExecutor
 
 # Input.yaml file path
 input_file = os.path.join(os.getcwd(), r'input.yaml')
 
+# Default path of the html report
+default_report_path = paths.default_report_path
+
+# Crime measures of the semantic layer and their dataframe column
+crime_metrics = {'robbery': 'Robbery', 'violent_crime_total': 'Violent_crime_total',
+                 'property_crime_total': 'Property_crime_total', 'total_crime': 'Total_crime'}
+
+# Page skeleton of the single file report, plotly.js is embedded once in its head
+report_template = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>USA unemployment, education and crime report</title>
+<script type="text/javascript">{plotlyjs}</script>
+</head>
+<body>
+{charts}
+</body>
+</html>
+"""
+
+
+def data_generation(postgresqlDB_details):
+    """
+    Get the data generation counter bumped by every postgres load
+    :return: generation, None if the database was never loaded
+    """
+    row = None
+    try:
+        with db_connections.pg_connection(postgresqlDB_details) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT generation FROM data_generation")
+            row = cursor.fetchone()
+            cursor.close()
+    except (Exception, pg.Error) as e:
+        print(e)
+    return row[0] if row else None
+
 
-def fetch_unemployment_data(postgresqlDB_details):
+def open_query_cache(postgresqlDB_details, settings=None):
     """
-    Get unemployment data from postgresql
-    :return: unemployment_data: unemployment data from postgresql
+    Open the query result cache at the data generation of the database
+    :param settings: query_cache section of input.yaml
+    :return: cache, None if it is disabled or the database was never loaded
+    """
+    settings = settings or {}
+    if not settings.get('enabled', True):
+        return None
+    generation = data_generation(postgresqlDB_details)
+    if generation is None:
+        return None
+    return query_cache.open_cache(settings, generation)
+
+
+def fetch_frame(postgresqlDB_details, query, dtypes, fetch_size=10000, cache=None, params=None):
     """
-    get_unemployment_data_query = "SELECT x.year, state, avg(unemployment_rate) FROM (SELECT state_year.year, " \
-                                  "state_year.state, unemp_rate.unemployment_rate FROM unemployment_rate as unemp_rate " \
-                                  "JOIN state_year ON unemp_rate.state_year_id = state_year.state_year_id) " \
-                                  "as X GROUP BY year, state"
-    data = None
+    Run a query on a server side cursor and build a typed dataframe from batches of fetched rows
+    :param dtypes: dict of dataframe column name to dtype, in the order of the selected columns
+    :param fetch_size: rows transferred per round trip
+    :param cache: query result cache, results of the current data generation are read from it
+    :param params: query parameters
+    :return: dataframe with the dtypes, empty if the query failed
+    """
+    if cache is not None:
+        key = query_cache.cache_key(cache, query, params)
+        cached = query_cache.get(cache, key)
+        if cached is not None:
+            return cached
+
+    columns = list(dtypes)
+    frames = []
     try:
-        conn = pg.connect(user=postgresqlDB_details['username'],
-                          password=postgresqlDB_details['password'],
-                          host=postgresqlDB_details['pg_host'],
-                          port=postgresqlDB_details['pg_port'],
-                          database=postgresqlDB_details['pg_db'])
-        cursor = conn.cursor()
-        cursor.execute(get_unemployment_data_query)
-        data = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        with db_connections.pg_connection(postgresqlDB_details) as conn:
+            # named cursors stream the result from the server instead of buffering it in the client
+            cursor = conn.cursor(name='visualize_fetch')
+            cursor.itersize = fetch_size
+            cursor.execute(query, params)
+            rows = cursor.fetchmany(fetch_size)
+            while rows:
+                frames.append(pd.DataFrame.from_records(rows, columns=columns))
+                rows = cursor.fetchmany(fetch_size)
+            cursor.close()
+            conn.commit()
     except (Exception, pg.Error) as e:
         print(e)
-    unemployment_data = pd.DataFrame(data, columns=['year', 'state', 'avg_unemployment_rate'])
+        cache = None
+    if not frames:
+        frames.append(pd.DataFrame(columns=columns))
+    frame = pd.concat(frames, ignore_index=True).astype(dtypes)
+
+    if cache is not None:
+        query_cache.put(cache, key, frame)
+    return frame
+
+
+def fetch_measures(postgresqlDB_details, names, dims, filters=None, fetch_size=10000, cache=None):
+    """
+    Get measures aggregated by dimensions in postgresql, only the aggregated rows are fetched
+    :param names: measure names of semantic_layer.measures
+    :param dims: dimension names of semantic_layer.dimensions
+    :param filters: list of (dimension, operator, value)
+    :return: dataframe with a column per dimension and measure
+    """
+    query, params, dtypes = semantic_layer.compile_query(names, dims, filters)
+    return fetch_frame(postgresqlDB_details, query, dtypes, fetch_size, cache, params)
+
+
+def state_filter(state):
+    """
+    Get semantic layer filters selecting one state, or every state if state is None
+    """
+    return [('state', '=', state)] if state else []
+
+
+def fetch_unemployment_data(postgresqlDB_details, fetch_size=10000, cache=None, state=None):
+    """
+    Get unemployment data from postgresql
+    :param state: only fetch rows of this state
+    :return: unemployment_data: unemployment data from postgresql
+    """
+    unemployment_data = fetch_measures(postgresqlDB_details, ['avg_unemployment_rate'], ['year', 'state'],
+                                       state_filter(state), fetch_size, cache)
 
     return unemployment_data
 
 
-def fetch_education_data(postgresqlDB_details):
+def fetch_education_data(postgresqlDB_details, fetch_size=10000, cache=None, state=None):
     """
     Get education data from postgresql
+    :param state: only fetch rows of this state
     :return: education_data: education data from postgresql
     """
-    get_education_data_query = "SELECT state_year.year, state_year.state, edu_exp.total_revenue, " \
-                                  "edu_exp.federal_revenue, edu_exp.state_revenue, edu_exp.local_revenue, " \
-                                  "edu_exp.total_expenditure, edu_exp.instruction_expenditure, " \
-                                  "edu_exp.support_services_expenditure, edu_exp.other_expenditure, " \
-                                  "edu_exp.capital_outlay_expenditure FROM education_expenditure as edu_exp " \
-                                  "JOIN state_year ON edu_exp.state_year_id = state_year.state_year_id"
-    data = None
-    try:
-        conn = pg.connect(user=postgresqlDB_details['username'],
-                          password=postgresqlDB_details['password'],
-                          host=postgresqlDB_details['pg_host'],
-                          port=postgresqlDB_details['pg_port'],
-                          database=postgresqlDB_details['pg_db'])
-        cursor = conn.cursor()
-        cursor.execute(get_education_data_query)
-        data = cursor.fetchall()
-        cursor.close()
-        conn.close()
-    except (Exception, pg.Error) as e:
-        print(e)
-    education_data = pd.DataFrame(data, columns=['year', 'state', 'total_revenue', 'federal_revenue',
-                                                    'state_revenue', 'local_revenue', 'total_expenditure',
-                                                    'instruction_expenditure', 'support_services_expenditure',
-                                                    'other_expenditure', 'capital_outlay_expenditure'])
+    education_data = fetch_measures(postgresqlDB_details, ['total_revenue', 'total_expenditure'], ['year', 'state'],
+                                    state_filter(state), fetch_size, cache)
 
     return education_data
 
 
-def fetch_crime_data(postgresqlDB_details):
+def fetch_crime_data(postgresqlDB_details, fetch_size=10000, cache=None, state=None):
     """
-    Get crime data from postgresql
+    Get per state crime totals from postgresql
+    :param state: only fetch rows of this state
     :return: crime_data: crime rate data from postgresql
     """
-    get_crime_data_query = "SELECT state_year.year, state_year.state, crime_rate.population_coverage, " \
-                                  "crime_rate.violent_crime_total, crime_rate.murder_and_nonnegligent_manslaughter, " \
-                                  "crime_rate.legacy_rape1, crime_rate.robbery, crime_rate.aggravated_assault, " \
-                                  "crime_rate.property_crime_total, crime_rate.burglary, " \
-                                  "crime_rate.larceny_theft, crime_rate.motor_vehicle_theft FROM crime_rate " \
-                                  "JOIN state_year ON crime_rate.state_year_id = state_year.state_year_id"
-    data = None
-    try:
-        conn = pg.connect(user=postgresqlDB_details['username'],
-                          password=postgresqlDB_details['password'],
-                          host=postgresqlDB_details['pg_host'],
-                          port=postgresqlDB_details['pg_port'],
-                          database=postgresqlDB_details['pg_db'])
-        cursor = conn.cursor()
-        cursor.execute(get_crime_data_query)
-        data = cursor.fetchall()
-        cursor.close()
-        conn.close()
-    except (Exception, pg.Error) as e:
-        print(e)
-    crime_data = pd.DataFrame(data, columns=['year', 'state', 'Population_Coverage', 'Violent_crime_total',
-                                                 'Murder_and_nonnegligent_manslaughter', 'Legacy_rape1', 'Robbery',
-                                                 'Aggravated_assault', 'Property_crime_total', 'Burglary',
-                                                 'Larceny_theft', 'Motor_vehicle_theft'])
+    crime_data = fetch_measures(postgresqlDB_details, list(crime_metrics), ['year', 'state'], state_filter(state),
+                                fetch_size, cache)
+
+    return crime_data.rename(columns=crime_metrics)
 
-    return crime_data
 
-def visualize_unemployment_rate(unemployment_data):
+def fetch_national_totals(postgresqlDB_details, fetch_size=10000, cache=None):
+    """
+    Get per year totals of education expenditure and crime in USA from postgresql
+    :return: edu_total_data, crime_total_data: dataframes indexed by year
+    """
+    totals = fetch_measures(postgresqlDB_details, ['total_expenditure', 'total_crime'], ['year'],
+                            fetch_size=fetch_size, cache=cache).set_index('year')
+    totals = totals.rename(columns={'total_crime': 'Total_crime'})
+
+    return totals[['total_expenditure']], totals[['Total_crime']]
+
+
+def fetch_all(postgresqlDB_details, settings=None, cache=None):
+    """
+    Run the chart queries concurrently on pooled connections
+    :param settings: visualize_settings of input.yaml
+    :param cache: query result cache shared by the fetches
+    :return: dict of fetch name to future of its result
+    """
+    settings = settings or {}
+    fetch_size = settings.get('fetch_size', 10000)
+    fetches = {'unemployment': fetch_unemployment_data, 'education': fetch_education_data,
+               'crime': fetch_crime_data, 'national_totals': fetch_national_totals}
+    executor = ThreadPoolExecutor(max_workers=settings.get('fetch_workers', len(fetches)))
+    futures = {name: executor.submit(fetch, postgresqlDB_details, fetch_size, cache) for name, fetch in fetches.items()}
+    # running fetches finish in the background, the caller waits on each future when it renders
+    executor.shutdown(wait=False)
+    return futures
+
+
+def visualize_unemployment_rate(unemployment_data, settings=None):
     """
-    Visualize and plot graphs for unemployment rate data
+    Visualize and plot graphs for unemployment rate data. Every state series is downsampled to
+    max_points_per_series and large charts are drawn with WebGL.
     :param unemployment_data: unemployment data from postgresql
+    :param settings: visualize_settings of input.yaml
     """
+    settings = settings or {}
+    unemployment_data, dropped = chart_downsampling.downsample(
+        unemployment_data, 'year', 'avg_unemployment_rate', 'state',
+        settings.get('max_points_per_series', chart_downsampling.default_max_points))
+    mode = chart_downsampling.render_mode(len(unemployment_data),
+                                          settings.get('webgl_threshold', chart_downsampling.default_webgl_threshold))
+    if dropped or mode == 'webgl':
+        print('Unemployment chart: {} points drawn with {}, {} dropped by downsampling'.format(
+            len(unemployment_data), mode, dropped))
+
     # Visualising change in Unemployment rate for every state in USA for selected period
     unemployment_data = unemployment_data.sort_values(by=['year'])
-    fig = px.line(unemployment_data, x='year', y='avg_unemployment_rate', color='state')
-    fig.show()
+    fig = px.line(unemployment_data, x='year', y='avg_unemployment_rate', color='state', render_mode=mode)
+    return [fig]
 
 
 def visualize_education_data(edu_df):
@@ -129,44 +234,34 @@ def visualize_education_data(edu_df):
     fig2 = px.bar(edu_df, x='year', y='total_expenditure',
                   hover_data=['state'], color='state',
                   labels={'total_expenditure': 'TOTAL EXPENDITURE'}, height=400)
-    fig1.show()
-    fig2.show()
+    return [fig1, fig2]
 
 
-def visualize_crime_data(crime_data):
+def visualize_crime_data(crime_data, state='Alabama', metric='Robbery'):
     """
     Generate visualization plots for crime data
+    :param state: state to plot
+    :param metric: crime column to plot, a value of crime_metrics
     """
 
-    # data_alabama = state_data.gapminder().query("State == 'Alabama'")
-    Alabama_data = crime_data[crime_data['state'] == 'Alabama']
-    fig = px.bar(Alabama_data, x='year', y='Robbery',
+    state_data = crime_data[crime_data['state'] == state]
+    fig = px.bar(state_data, x='year', y=metric,
                  hover_data=['year'])
-    fig.show()
+    return [fig]
 
 
-def visualize_combined_result(unemployment_data, education_data, crime_data):
+def visualize_combined_result(unemployment_data, edu_total_data, crime_total_data):
     """
     Generate visualization plots
+    :param edu_total_data: total education expenditure in USA per year
+    :param crime_total_data: total crime in USA per year
     """
 
-    # Calculate total of education expenditure in USA per year
-    edu_total_data = pd.DataFrame(education_data, columns=['year', 'total_expenditure'])
-    edu_total_data = edu_total_data.groupby(['year']).sum()
-
-    # Calculate total crime in USA per year
-    crime_data['Total_crime'] = crime_data['Motor_vehicle_theft'] + crime_data['Larceny_theft'] + crime_data['Burglary'] + \
-                          crime_data['Property_crime_total'] + crime_data['Aggravated_assault'] + crime_data['Robbery']\
-                          + crime_data['Legacy_rape1'] + crime_data['Murder_and_nonnegligent_manslaughter'] + \
-                          crime_data['Violent_crime_total']
-    crime_total_data = crime_data.groupby(['year']).sum()
-
-
     # Calculate average unemployment rate in USA per year
-    unemp_total_data = unemployment_data.groupby(['year']).sum()
+    unemp_total_data = unemployment_data.groupby(['year'])[['avg_unemployment_rate']].sum()
 
     # Visualize crime, unemployment and education expenditure pattern in USA per year
-    draw_combined_graph(unemp_total_data, edu_total_data, crime_total_data)
+    return [draw_combined_graph(unemp_total_data, edu_total_data, crime_total_data)]
 
 
 def draw_combined_graph(unemp_total_data, edu_total_data, crime_total_data):
@@ -241,36 +336,130 @@ def draw_combined_graph(unemp_total_data, edu_total_data, crime_total_data):
         width=1800,
     )
 
-    fig.show()
+    return fig
 
 
-def main():
+def empty_fetches(fetched):
+    """
+    Get names of the fetches without rows, a failed query also returns an empty dataframe
+    :param fetched: dict of fetch name to future of its result, from fetch_all
+    :return: list of fetch names
+    """
+    empty = []
+    for name, future in fetched.items():
+        result = future.result()
+        frames = result if isinstance(result, tuple) else (result,)
+        if any(frame.empty for frame in frames):
+            empty.append(name)
+    return empty
+
+
+def build_figures(fetched, settings=None):
+    """
+    Build the figures of all charts in parallel, each as soon as the data it plots is fetched
+    :param fetched: dict of fetch name to future of its result, from fetch_all
+    :param settings: visualize_settings of input.yaml
+    :return: list of (chart title, figures) in report order
+    """
+    settings = settings or {}
+    crime_state = settings.get('crime_state', 'Alabama')
+    charts = [('Unemployment rate by state',
+               lambda: visualize_unemployment_rate(fetched['unemployment'].result(), settings)),
+              ('Education revenue and expenditure', lambda: visualize_education_data(fetched['education'].result())),
+              ('Robbery in {}'.format(crime_state),
+               lambda: visualize_crime_data(fetched['crime'].result(), crime_state)),
+              ('Unemployment, education expenditure and crime in USA',
+               lambda: visualize_combined_result(fetched['unemployment'].result(),
+                                                 *fetched['national_totals'].result()))]
+    with ThreadPoolExecutor(max_workers=settings.get('fetch_workers', 4)) as executor:
+        futures = [(title, executor.submit(build)) for title, build in charts]
+        return [(title, future.result()) for title, future in futures]
+
+
+def write_report(charts, settings=None):
+    """
+    Write all charts to one html file, or with report_format 'directory' to one page per chart
+    sharing a single plotly.min.js
+    :param charts: list of (chart title, figures) from build_figures
+    :param settings: visualize_settings of input.yaml
+    :return: path of the report
+    """
+    settings = settings or {}
+    report_format = settings.get('report_format', 'html')
+    path = settings.get('report_path', default_report_path)
+
+    if report_format == 'directory':
+        if not os.path.exists(path):
+            os.makedirs(path)
+        links = []
+        for i, (title, figures) in enumerate(charts, 1):
+            for j, fig in enumerate(figures, 1):
+                page = 'chart_{}_{}.html'.format(i, j)
+                fig.write_html(os.path.join(path, page), include_plotlyjs='directory')
+                links.append('<li><a href="{}">{} ({})</a></li>'.format(page, title, j))
+        with open(os.path.join(path, 'index.html'), 'w') as index_file:
+            index_file.write('<!DOCTYPE html>\n<html>\n<body>\n<ul>\n{}\n</ul>\n</body>\n</html>\n'.format(
+                '\n'.join(links)))
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    elif report_format == 'html':
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        sections = []
+        for title, figures in charts:
+            sections.append('<h2>{}</h2>'.format(title))
+            sections.extend(fig.to_html(full_html=False, include_plotlyjs=False) for fig in figures)
+        with open(path, 'w', encoding='utf-8') as report_file:
+            report_file.write(report_template.format(plotlyjs=plotly.offline.get_plotlyjs(),
+                                                     charts='\n'.join(sections)))
+        size = os.path.getsize(path)
+    else:
+        raise ValueError('Unknown report format {}'.format(report_format))
+
+    print('Wrote report to {} ({:.1f} MB)'.format(path, size / (1024 * 1024)))
+    return path
+
+
+def main(cfg=None):
     """
     Fetch data from postgresql db and visualize
+    :param cfg: parsed input.yaml, read from input_file if None
     """
-    # fetch inputs from input.yaml file
-    with open(input_file, 'r') as ymlfile:
-        cfg = yaml.safe_load(ymlfile)
+    # fetch inputs from input.yaml file unless the runner passed them
+    if cfg is None:
+        with open(input_file, 'r') as ymlfile:
+            cfg = yaml.safe_load(ymlfile)
 
     # db name and collection name for all datasets in mongoDB
     postgresqlDB_details = cfg['postgresqlDB_details']
 
-    # Get unemployment rate data and visualize
-    unemployment_data = fetch_unemployment_data(postgresqlDB_details)
-    visualize_unemployment_rate(unemployment_data)
+    # Query all chart data at once, each chart renders as soon as its own data arrived.
+    # Results are reused until the next load bumps the data generation
+    cache = open_query_cache(postgresqlDB_details, cfg.get('query_cache'))
+    fetched = fetch_all(postgresqlDB_details, cfg.get('visualize_settings'), cache)
+
+    # Build unemployment, education, crime and combined charts, totals come pre-aggregated per year
+    visualize_settings = cfg.get('visualize_settings') or {}
+    charts = build_figures(fetched, visualize_settings)
 
-    # Get education data and visualize
-    education_data = fetch_education_data(postgresqlDB_details)
-    visualize_education_data(education_data)
+    # every fetch finished, the access times of cache hits are written once
+    if cache is not None:
+        query_cache.close_cache(cache)
+        query_cache.print_stats(cache)
 
-    # Get education data and visualize
-    crime_data = fetch_crime_data(postgresqlDB_details)
-    visualize_crime_data(crime_data)
+    # a report of empty charts must not count as a successful run
+    empty = empty_fetches(fetched)
+    if empty:
+        raise RuntimeError('No data for {} charts'.format(', '.join(empty)))
 
-    # Visualize final result on relation between all three data
-    visualize_combined_result(unemployment_data, education_data, crime_data)
+    # 'report' writes all charts to a file for unattended runs, 'show' opens each chart in the browser
+    if visualize_settings.get('output', 'show') == 'report':
+        write_report(charts, visualize_settings)
+    else:
+        for title, figures in charts:
+            for fig in figures:
+                fig.show()
 
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
\ No newline at end of file